@@ -0,0 +1,74 @@
+"""
+Goodput under overload: the same number of units is bought by more and more
+consumers that retry add_to_cart without waiting, with and without the
+AdmissionControl in front of the marketplace. Goodput is the number of ordered
+units per second, the median of repeat runs (the runs with and without admission
+alternate, so a slower period of the machine affects both).
+
+Usage: python3 -m benchmarks.admission [units] [max_consumers] [max_concurrent] [rate] [repeat]
+"""
+import statistics
+import sys
+import time
+
+from tema.admission import AdmissionControl
+from tema.consumer import Consumer
+from tema.marketplace import Marketplace
+from tema.producer import Producer
+
+PRODUCTS = ["branza", "oua", "lapte", "ulei"]
+UNITS_PER_CART = 4
+
+
+def run(consumers, units, admission):
+    """
+    Buys units units with consumers consumers and returns the goodput and the shed calls.
+    """
+    marketplace = Marketplace(8)
+    market = marketplace if admission is None else AdmissionControl(marketplace, **admission)
+    producers = [Producer([(product, 4, 0)], market, 0, daemon=True) for product in PRODUCTS]
+    carts = units // UNITS_PER_CART // consumers
+    buyers = [Consumer([[{"type": "add", "product": PRODUCTS[(i + j) % len(PRODUCTS)],
+                          "quantity": 1} for j in range(UNITS_PER_CART)]] * carts,
+                       market, 0, name=f"cons{i}")
+              for i in range(consumers)]
+
+    start = time.perf_counter()
+    for thread in producers + buyers:
+        thread.start()
+    for buyer in buyers:
+        buyer.join()
+    elapsed = time.perf_counter() - start
+    marketplace.close()
+    for producer in producers:
+        producer.join()
+
+    ordered = sum(marketplace.order_history.units_per_product().values())
+    return ordered / elapsed, getattr(market, "shed", 0)
+
+
+def main():
+    units = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    max_consumers = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    max_concurrent = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    rate = float(sys.argv[4]) if len(sys.argv) > 4 else 10000.0
+    repeat = int(sys.argv[5]) if len(sys.argv) > 5 else 5
+    admission = {"rate": rate, "max_concurrent": max_concurrent}
+
+    print(f"{'consumers':>10}{'goodput':>16}{'with admission':>20}{'shed calls':>14}")
+    consumers = 2
+    while consumers <= max_consumers:
+        plain, admitted, shed = [], [], []
+        for _ in range(repeat):
+            plain.append(run(consumers, units, None)[0])
+            goodput, calls = run(consumers, units, admission)
+            admitted.append(goodput)
+            shed.append(calls)
+        plain, admitted, shed = (statistics.median(plain), statistics.median(admitted),
+                                 int(statistics.median(shed)))
+        print(f"{consumers:>10}{plain:>12.0f} u/s{admitted:>16.0f} u/s{shed:>14}")
+        consumers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Cart plans benchmark: the memory held by the parsed carts of a large input file
+against their compiled plans (one PlanCompiler for all the consumers), and the
+time per unit of the consumer loop over the dicts (the loop before the plans)
+and over the plan, with a marketplace that does nothing.
+
+Usage: python3 -m benchmarks.cart_plans [consumers] [carts_per_consumer] [products]
+"""
+import random
+import sys
+import time
+import tracemalloc
+from json import dumps, loads
+
+from tema.consumer import Consumer
+from tema.plan import PlanCompiler
+
+MAX_OPERATIONS = 10
+MAX_QUANTITY = 5
+REPEATS = 3
+
+
+class NullMarketplace:
+    """
+    Accepts every call right away, so only the consumer's own loop is measured.
+    """
+    def __init__(self):
+        self.carts = 0
+
+    def new_cart(self):
+        """
+        Returns a new cart id
+        """
+        self.carts += 1
+        return self.carts
+
+    def add_to_cart(self, cart_id, product):
+        """
+        Always succeeds
+        """
+        return True
+
+    def remove_from_cart(self, cart_id, product):
+        """
+        Does nothing
+        """
+
+    def place_order(self, cart_id):
+        """
+        Does nothing
+        """
+
+
+def generate(consumers, carts_per_consumer, products, seed=0):
+    """
+    Returns the consumers of an input file, as json: carts of up to MAX_OPERATIONS
+    adds, some of them followed by a remove of the product just added.
+    """
+    rng = random.Random(seed)
+    config = []
+    for i in range(consumers):
+        carts = []
+        for _ in range(carts_per_consumer):
+            cart = []
+            for _ in range(rng.randint(1, MAX_OPERATIONS)):
+                product = f"id{rng.randint(1, products)}"
+                quantity = rng.randint(1, MAX_QUANTITY)
+                cart.append({"type": "add", "product": product, "quantity": quantity})
+                if rng.random() < 0.2:
+                    cart.append({"type": "remove", "product": product,
+                                 "quantity": rng.randint(1, quantity)})
+            carts.append(cart)
+        config.append({"name": f"cons{i}", "retry_wait_time": 0.1, "carts": carts})
+    return dumps(config)
+
+
+def run_dicts(carts, marketplace):
+    """
+    The consumer loop over the parsed operations, as it was before the plans.
+    """
+    for cart in carts:
+        cart_id = marketplace.new_cart()
+        for elements in cart:
+            quantity_so_far = 0
+            while quantity_so_far < elements["quantity"]:
+                if elements["type"] == "remove":
+                    marketplace.remove_from_cart(cart_id, elements["product"])
+                    quantity_so_far += 1
+                    continue
+                if elements["type"] == "add":
+                    if marketplace.add_to_cart(cart_id, elements["product"]):
+                        quantity_so_far += 1
+        marketplace.place_order(cart_id)
+
+
+def best_time(function):
+    """
+    Returns the best time of REPEATS calls.
+    """
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    consumers = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    carts_per_consumer = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    products = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    text = generate(consumers, carts_per_consumer, products)
+    # the products are looked up by id, like test.py does
+    catalog = {f"id{i}": f"product {i}" for i in range(1, products + 1)}
+
+    # the carts of the first 100 consumers, for the loop over the dicts
+    dict_carts = [consumer["carts"] for consumer in loads(text)[:100]]
+
+    tracemalloc.start()
+    config = loads(text)
+    parsed = tracemalloc.get_traced_memory()[0]
+    operations = sum(len(cart) for consumer in config for cart in consumer["carts"])
+    units = sum(operation["quantity"] for consumer in config for cart in consumer["carts"]
+                for operation in cart)
+
+    # like test.py: the parsed carts are replaced by their plans
+    compiler = PlanCompiler()
+    for consumer in config:
+        consumer["carts"] = compiler.compile(consumer["carts"], catalog)
+    compiled = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    plans = [consumer["carts"] for consumer in config]
+    merged = sum(plan.operations for plan in plans)
+    print(f"{consumers} consumers, {operations} operations ({units} units), "
+          f"{merged} operations after merging, {len(compiler.carts)} distinct carts")
+    print(f"    consumers with parsed carts   {parsed:>12} bytes "
+          f"({parsed / operations:.1f} per operation)")
+    print(f"    consumers with compiled plans {compiled:>12} bytes "
+          f"({compiled / operations:.1f} per operation)")
+
+    # the loop of the first 100 consumers, run directly (no threads)
+    marketplace = NullMarketplace()
+    dict_units = sum(operation["quantity"] for carts in dict_carts for cart in carts
+                     for operation in cart)
+    dicts = best_time(lambda: [run_dicts(carts, marketplace) for carts in dict_carts])
+    buyers = [Consumer(plan, marketplace, 0.1) for plan in plans[:100]]
+    planned = best_time(lambda: [buyer.run() for buyer in buyers])
+    print(f"    consumer loop over dicts {dicts / dict_units * 1e9:>8.1f} ns per unit")
+    print(f"    consumer loop over plans {planned / dict_units * 1e9:>8.1f} ns per unit "
+          f"(the removes merged into adds are not executed)")
+
+
+if __name__ == "__main__":
+    main()
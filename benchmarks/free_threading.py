@@ -0,0 +1,110 @@
+"""
+Scaling report of the Marketplace across thread counts. Each pair of threads is
+a producer and a consumer doing a fixed number of operations; between two
+operations every thread does some pure Python work (the equivalent of the time
+the real Producer/Consumer spend outside the marketplace).
+
+Run it with a free-threaded build to see whether the threads use several cores:
+    PYTHON_GIL=0 python3.13t -m benchmarks.free_threading [operations] [work] [queue_size]
+                                                          [products]
+
+queue_size is the size of each producer's queue and products the number of distinct
+products: with large queues and many products many units stay in stock, which shows
+what an operation costs when the stock is large.
+"""
+import os
+import sys
+import time
+from threading import Barrier, Thread
+
+from tema.marketplace import Marketplace
+
+THREAD_PAIRS = [1, 2, 4, 8, 16]
+
+
+def busy_work(iterations):
+    """
+    CPU bound work done outside of the marketplace.
+    """
+    total = 0
+    for i in range(iterations):
+        total += i * i
+    return total
+
+
+def produce(marketplace, barrier, operations, work, products):
+    """
+    Publishes operations products.
+    """
+    producer_id = marketplace.register_producer()
+    barrier.wait()
+    published = 0
+    while published < operations:
+        if marketplace.publish(producer_id, products[published % len(products)]):
+            published += 1
+        else:
+            # the queue is full, give the consumers a chance (like republish_wait_time)
+            time.sleep(0)
+        busy_work(work)
+
+
+def consume(marketplace, barrier, operations, work, products):
+    """
+    Buys operations products, one per cart.
+    """
+    barrier.wait()
+    for i in range(operations):
+        cart_id = marketplace.new_cart()
+        attempt = i
+        while not marketplace.add_to_cart(cart_id, products[attempt % len(products)]):
+            attempt += 1
+            if attempt % len(products) == i % len(products):
+                # nothing in stock, give the producers a chance (like retry_wait_time)
+                time.sleep(0)
+        marketplace.place_order(cart_id)
+        busy_work(work)
+
+
+def run(pairs, operations, work, queue_size, products):
+    """
+    Returns the number of marketplace operations per second done by pairs producer/consumer
+    pairs, each thread doing operations successful publish/place_order calls.
+    """
+    marketplace = Marketplace(queue_size)
+    barrier = Barrier(2 * pairs + 1)
+    threads = [Thread(target=produce, args=(marketplace, barrier, operations, work, products))
+               for _ in range(pairs)]
+    threads += [Thread(target=consume, args=(marketplace, barrier, operations, work, products))
+                for _ in range(pairs)]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return 2 * pairs * operations / elapsed
+
+
+def main():
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    work = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    queue_size = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    products = [f"product{i}" for i in range(int(sys.argv[4]) if len(sys.argv) > 4 else 4)]
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+
+    print(f"GIL enabled: {gil_enabled}, cpus: {os.cpu_count()}, "
+          f"operations per thread: {operations}, work per operation: {work}, "
+          f"queue size: {queue_size}, products: {len(products)}")
+    print(f"{'threads':>8}{'ops/s':>12}{'speedup':>10}")
+    baseline = None
+    for pairs in THREAD_PAIRS:
+        throughput = run(pairs, operations, work, queue_size, products)
+        baseline = baseline or throughput
+        print(f"{2 * pairs:>8}{throughput:>12.0f}{throughput / baseline:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
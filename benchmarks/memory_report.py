@@ -0,0 +1,84 @@
+"""
+Memory report of the Marketplace: a flood of producers and consumers that never
+finish their carts, run once unbounded and once in bounded mode. Prints the
+explicit accounting (get_memory_stats) and the allocations seen by tracemalloc.
+
+Usage: python3 -m benchmarks.memory_report [units] [carts] [max_units] [max_open_carts]
+"""
+import sys
+import tracemalloc
+from threading import Thread
+
+from tema.marketplace import Marketplace
+from tema.product import Coffee
+
+PRODUCTS = [Coffee(name=f"Arabica {i}", price=i % 10 + 1, acidity=5.0, roast_level="DARK")
+            for i in range(100)]
+NUM_PRODUCERS = 100
+UNITS_PER_CART = 5
+
+
+def flood(marketplace, units, carts):
+    """
+    Tries to publish units products and to fill carts carts, without ever ordering.
+    Returns the number of published units and of opened carts.
+    """
+    producers = [marketplace.register_producer() for _ in range(NUM_PRODUCERS)]
+    # every queue holds every product, so add_to_cart finds them without
+    # scanning all the queues
+    published = sum(marketplace.publish(producers[i % NUM_PRODUCERS],
+                                        PRODUCTS[i // NUM_PRODUCERS % len(PRODUCTS)])
+                    for i in range(units))
+
+    opened = []
+
+    def open_cart():
+        opened.append(marketplace.new_cart())
+
+    for i in range(carts):
+        # new_cart blocks in bounded mode, give up on it after a while
+        thread = Thread(target=open_cart, daemon=True)
+        thread.start()
+        thread.join(0.01 if marketplace.bounds.max_open_carts is not None else None)
+        if thread.is_alive():
+            break
+        for j in range(UNITS_PER_CART):
+            marketplace.add_to_cart(opened[-1], PRODUCTS[(i + j) % len(PRODUCTS)])
+    return published, len(opened)
+
+
+def report(name, max_units, max_open_carts, units, carts):
+    """
+    Runs the flood on a new marketplace and prints its memory usage.
+    """
+    tracemalloc.start()
+    marketplace = Marketplace(units, max_units=max_units, max_open_carts=max_open_carts)
+    published, opened = flood(marketplace, units, carts)
+    traced, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = marketplace.get_memory_stats()
+    print(f"{name}: published {published} units, opened {opened} carts")
+    print(f"    units in stock {stats.units_in_stock}, in queues {stats.units_in_queues}, "
+          f"in carts {stats.units_in_carts}, open carts {stats.open_carts}")
+    for structure, size in sorted(stats.bytes_per_structure.items()):
+        print(f"    {structure:<20}{size:>14} bytes")
+    print(f"    {'total':<20}{stats.total_bytes:>14} bytes (tracemalloc: {traced} bytes, "
+          f"peak {peak} bytes)")
+    print(f"    {stats.bytes_per_unit:.1f} bytes per unit in stock, "
+          f"{stats.bytes_per_cart:.1f} bytes per open cart")
+
+
+def main():
+    units = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    carts = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    max_units = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+    max_open_carts = int(sys.argv[4]) if len(sys.argv) > 4 else 500
+
+    report("unbounded", None, None, units, carts)
+    report(f"bounded (max_units={max_units}, max_open_carts={max_open_carts})",
+           max_units, max_open_carts, units, carts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Order history benchmark: the cost of append_order (called by every place_order)
+and the time of the aggregate queries over many order lines, in memory and
+spilled to memory-mapped files, with numpy and with the pure Python fallback.
+
+Usage: python3 -m benchmarks.order_history [lines] [products_per_order]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from tema import orders
+from tema.orders import OrderHistory
+from tema.product import Coffee
+
+PRODUCTS = [Coffee(name=f"Arabica {i}", price=i % 10 + 1, acidity=5.0, roast_level="DARK")
+            for i in range(100)]
+CONSUMERS = [f"cons{i}" for i in range(1000)]
+QUERIES = ["revenue", "units_per_product", "revenue_per_product", "totals_per_consumer"]
+
+
+def fill(history, lines, per_order):
+    """
+    Appends lines // per_order orders and returns the time per append_order call.
+    """
+    start = time.perf_counter()
+    for order_id in range(lines // per_order):
+        history.append_order(order_id, CONSUMERS[order_id % len(CONSUMERS)],
+                             [PRODUCTS[(order_id + i) % len(PRODUCTS)] for i in range(per_order)])
+    return (time.perf_counter() - start) / (lines // per_order)
+
+
+def run_queries(history, name):
+    """
+    Runs every query once and prints its time.
+    """
+    for query in QUERIES:
+        start = time.perf_counter()
+        getattr(history, query)()
+        print(f"    {name:<24}{query:<24}{time.perf_counter() - start:>10.3f} s")
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    per_order = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    history = OrderHistory()
+    append = fill(history, lines, per_order)
+    print(f"{len(history)} lines: {append * 1e6:.2f} us per append_order "
+          f"({per_order} products), {history.nbytes() / len(history):.1f} bytes per line")
+    numpy = orders.numpy
+    if numpy is not None:
+        run_queries(history, "in memory (numpy)")
+    orders.numpy = None
+    run_queries(history, "in memory (python)")
+    orders.numpy = numpy
+
+    with tempfile.TemporaryDirectory() as directory:
+        spilled = OrderHistory(os.path.join(directory, "orders"), spill_rows=1 << 20)
+        append = fill(spilled, lines, per_order)
+        print(f"spilled {spilled.spilled_rows} lines: {append * 1e6:.2f} us per append_order")
+        if numpy is not None:
+            run_queries(spilled, "spilled (numpy)")
+        spilled.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Local load test of the MarketplaceServer: several client processes, each with
+many connections (one thread per connection), create and order empty carts.
+Reports the round-trip latency of single calls and the throughput with and
+without pipelining.
+
+Usage: python3 -m benchmarks.server_load [processes] [connections_per_process] [duration]
+                                         [pipeline_depth]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import Process, Queue
+from threading import Barrier, Thread
+
+from tema.client import MarketplaceClient
+
+
+def single_calls(client, deadline, latencies):
+    """
+    One request at a time; records the latency of each one.
+    """
+    operations = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        cart_id = client.new_cart()
+        middle = time.perf_counter()
+        client.place_order(cart_id)
+        end = time.perf_counter()
+        latencies += [middle - start, end - middle]
+        operations += 2
+    return operations
+
+
+def pipelined_calls(client, deadline, depth):
+    """
+    depth requests per round trip.
+    """
+    operations = 0
+    while time.perf_counter() < deadline:
+        with client.pipeline() as pipeline:
+            for _ in range(depth // 2):
+                pipeline.new_cart()
+        with client.pipeline() as orders:
+            for cart_id in pipeline.results:
+                orders.place_order(cart_id)
+        operations += 2 * len(pipeline.results)
+    return operations
+
+
+def client_process(socket_path, connections, duration, depth, results):
+    """
+    Runs connections threads, each with its own connection, and reports
+    (operations, latencies) for the single calls and the pipelined calls.
+    """
+    client = MarketplaceClient(socket_path, max_connections=connections)
+    for pipelined in (False, True):
+        barrier = Barrier(connections)
+        operations = [0] * connections
+        latencies = []
+
+        def worker(index):
+            barrier.wait()
+            deadline = time.perf_counter() + duration
+            if pipelined:
+                operations[index] = pipelined_calls(client, deadline, depth)
+            else:
+                operations[index] = single_calls(client, deadline, latencies)
+
+        threads = [Thread(target=worker, args=(i,)) for i in range(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results.put((pipelined, sum(operations), latencies))
+    client.close()
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which fraction of the sorted values are.
+    """
+    return values[min(int(fraction * len(values)), len(values) - 1)] if values else 0.0
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    connections = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+    depth = int(sys.argv[4]) if len(sys.argv) > 4 else 32
+
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, "market.sock")
+        with open(os.devnull, "w") as devnull:
+            server = subprocess.Popen([sys.executable, "-m", "tema.server", socket_path, "10"],
+                                      stdout=devnull, cwd=directory,
+                                      env=dict(os.environ, PYTHONPATH=os.getcwd()))
+        while not os.path.exists(socket_path):
+            time.sleep(0.05)
+
+        results = Queue()
+        clients = [Process(target=client_process,
+                           args=(socket_path, connections, duration, depth, results))
+                   for _ in range(processes)]
+        for client in clients:
+            client.start()
+        totals = {False: [0, []], True: [0, []]}
+        for _ in range(2 * processes):
+            pipelined, operations, latencies = results.get()
+            totals[pipelined][0] += operations
+            totals[pipelined][1] += latencies
+        for client in clients:
+            client.join()
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(totals[False][1])
+    print(f"connections: {processes * connections} ({processes} processes), "
+          f"pipeline depth: {depth}")
+    print(f"single calls:    {totals[False][0] / duration:>10.0f} ops/s, "
+          f"latency p50 {percentile(latencies, 0.5) * 1e6:.0f} us, "
+          f"p99 {percentile(latencies, 0.99) * 1e6:.0f} us")
+    print(f"pipelined calls: {totals[True][0] / duration:>10.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Measures the purchase throughput of the Marketplace while reader threads query
+the inventory, either through the lock-free snapshots (get_inventory) or by
+copying the inventory counters under the lock that every operation takes.
+
+Usage: python3 -m benchmarks.snapshot_readers [duration] [readers] [poll_interval]
+                                               [idle_producers]
+
+idle_producers registers that many producers that never publish, which makes the
+snapshots (and the locked reads) larger without changing the purchases.
+"""
+import sys
+import time
+from threading import Event, Thread
+
+from tema.marketplace import Marketplace
+
+PRODUCTS = [f"product{i}" for i in range(10)]
+NUM_PRODUCERS = 4
+NUM_CONSUMERS = 4
+# time a producer/consumer waits after a failed operation
+RETRY_WAIT_TIME = 0.0001
+
+
+def produce(marketplace, stop):
+    """
+    Publishes products in a loop, as fast as the queue allows.
+    """
+    producer_id = marketplace.register_producer()
+    while not stop.is_set():
+        for product in PRODUCTS:
+            if not marketplace.publish(producer_id, product):
+                time.sleep(RETRY_WAIT_TIME)
+
+
+def consume(marketplace, stop, purchases, index):
+    """
+    Buys one product per cart (whichever is in stock) and counts the placed orders.
+    """
+    attempts = 0
+    while not stop.is_set():
+        cart_id = marketplace.new_cart()
+        while not marketplace.add_to_cart(cart_id, PRODUCTS[attempts % len(PRODUCTS)]):
+            attempts += 1
+            if stop.is_set():
+                return
+            if attempts % len(PRODUCTS) == 0:
+                time.sleep(RETRY_WAIT_TIME)
+        marketplace.place_order(cart_id)
+        purchases[index] += 1
+
+
+def read_snapshots(marketplace, stop, reads, poll_interval):
+    """
+    Reads the stock through the lock-free snapshots.
+    """
+    while not stop.is_set():
+        snapshot = marketplace.get_inventory()
+        reads.append((sum(snapshot.stock.values()), snapshot.open_carts))
+        time.sleep(poll_interval)
+
+
+def read_locked(marketplace, stop, reads, poll_interval):
+    """
+    Reads the stock by copying the inventory counters under the tracker's lock.
+    """
+    while not stop.is_set():
+        inventory = marketplace.tracker.inventory
+        with marketplace.tracker.lock:
+            stock = dict(inventory.stock)
+            fill = dict(inventory.queue_fill)
+            open_carts = inventory.open_carts
+        reads.append((sum(stock.values()), len(fill), open_carts))
+        time.sleep(poll_interval)
+
+
+def run(duration, num_readers, reader, poll_interval, idle_producers):
+    """
+    Runs the market for duration seconds and returns (purchases/s, reads/s).
+    """
+    marketplace = Marketplace(8)
+    for _ in range(idle_producers):
+        marketplace.register_producer()
+    stop = Event()
+    purchases = [0] * NUM_CONSUMERS
+    reads = []
+
+    threads = [Thread(target=produce, args=(marketplace, stop)) for _ in range(NUM_PRODUCERS)]
+    threads += [Thread(target=consume, args=(marketplace, stop, purchases, i))
+                for i in range(NUM_CONSUMERS)]
+    threads += [Thread(target=reader, args=(marketplace, stop, reads, poll_interval))
+                for _ in range(num_readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return sum(purchases) / duration, len(reads) / duration
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    num_readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    poll_interval = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    idle_producers = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+
+    print(f"{'mode':<20}{'purchases/s':>15}{'reads/s':>15}")
+    for name, readers, reader in (("no readers", 0, read_snapshots),
+                                  ("snapshot readers", num_readers, read_snapshots),
+                                  ("locked readers", num_readers, read_locked)):
+        purchases, reads = run(duration, readers, reader, poll_interval, idle_producers)
+        print(f"{name:<20}{purchases:>15.0f}{reads:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
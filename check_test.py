@@ -5,41 +5,98 @@ Computer Systems Architecture Course
 Assignment 1
 March 2021
 """
-import subprocess
 import sys
+from collections import Counter
+
+# Reference files with this suffix hold one "count<TAB>line" entry per distinct line
+COUNTS_SUFFIX = ".counts"
+CHUNK_SIZE = 1 << 20
+MAX_REPORTED_LINES = 10
+
+
+def output_lines(output_file):
+    """
+    Yields the lines of the output in a single pass, reading it in chunks, so
+    the output can be arbitrarily large (or a pipe).
+    """
+    remainder = ""
+    while True:
+        chunk = output_file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        # sometimes there is no new line between consumer outputs
+        lines = (remainder + chunk).split(")")
+        remainder = lines.pop()
+        yield from (line.strip() + ")" for line in lines if len(line.strip()) > 0)
+
+    if len(remainder.strip()) > 0:
+        yield remainder.strip()
+
+
+def count_output_lines(output_file):
+    """
+    Counts the distinct lines of an output, keeping only the counters in memory.
+    """
+    return Counter(output_lines(output_file))
+
+
+def check_output(output_file, ref_counts):
+    """
+    Streams the output against the reference counts, which are decremented in
+    place: only the lines that are not (or no longer) expected are counted
+    apart. Returns (unexpected, missing) lines with their counts.
+    """
+    unexpected = Counter()
+    for line in output_lines(output_file):
+        if ref_counts[line] > 0:
+            ref_counts[line] -= 1
+        else:
+            unexpected[line] += 1
+    return unexpected, +ref_counts
+
+
+def load_reference(ref_filename):
+    """
+    Loads a reference file either in the count format (see COUNTS_SUFFIX) or
+    in the expanded format (one line per bought product, as in tests/*.ref.out).
+    """
+    with open(ref_filename) as ref_file:
+        if not ref_filename.endswith(COUNTS_SUFFIX):
+            return count_output_lines(ref_file)
+
+        counts = Counter()
+        for entry in ref_file:
+            count, line = entry.rstrip("\n").split("\t", 1)
+            counts[line] += int(count)
+        return counts
 
 
 def main():
     if len(sys.argv) != 4:
-        print("Invalid number of arguments\nUsage: check_test.py testname output_filepath ref_filepath")
+        print("Invalid number of arguments\nUsage: check_test.py testname output_filepath ref_filepath"
+              "\n(use - as output_filepath to read the output from stdin)")
         return
 
     testname = sys.argv[1]
     output_filename = sys.argv[2]
     ref_filename = sys.argv[3]
-    # load the lines from the output file and sort them
-    with open(output_filename) as output_file:
-        output_lines = output_file.read()
-
-    output_lines = output_lines.split(")")  # sometimes there is no new line between consumer outputs
-    output_lines = [line.strip() + ")" for line in output_lines if len(line.strip()) > 0]
 
-    output_lines.sort()
+    ref_counts = load_reference(ref_filename)
 
-    sorted_output_filename = output_filename + ".sorted"
-
-    # write to input file (tests/{test_name}.in)
-    with open(sorted_output_filename, 'w') as sorted_output_file:
-        for line in output_lines:
-            print(line, file=sorted_output_file)
-
-    command = subprocess.Popen(["diff", sorted_output_filename, ref_filename], stdout=subprocess.PIPE)
-    out, err = command.communicate()
+    if output_filename == "-":
+        unexpected, missing = check_output(sys.stdin, ref_counts)
+    else:
+        with open(output_filename) as output_file:
+            unexpected, missing = check_output(output_file, ref_counts)
 
-    if len(out) == 0:
+    if not unexpected and not missing:
         print(f"Test {testname}" + ":\t\t" + "PASSED")
     else:
         print(f"Test {testname}" + ":\t\t" + "FAILED")
+        # same convention as diff: < only in the output, > only in the reference
+        for sign, difference in (("<", unexpected), (">", missing)):
+            for line, count in sorted(difference.items())[:MAX_REPORTED_LINES]:
+                print(f"{sign} {count} x {line}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,286 @@
+"""
+This module represents the admission control in front of the Marketplace: when
+it is saturated, the consumers' retries are turned away right away with a Busy
+result instead of queueing on the marketplace's locks.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import time
+import unittest
+from threading import Event, Lock, Thread, current_thread
+
+from tema.marketplace import Marketplace
+
+DEFAULT_RATE = 10000.0
+DEFAULT_BURST = 10
+DEFAULT_MAX_CONCURRENT = 2
+# Seconds between two updates of the shares of the rate, on the shed path
+SHARE_INTERVAL = 0.05
+# Weight of the last retry in the average time a retry spends inside the marketplace
+SERVICE_TIME_WEIGHT = 0.1
+
+
+class TestAdmissionControl(unittest.TestCase):
+    """
+    Checks the token buckets and the concurrency limit.
+    """
+    def setUp(self):
+        self.marketplace = Marketplace(3)
+        self.admission = AdmissionControl(self.marketplace, rate=10, burst=2, max_concurrent=1)
+
+    def test_fair_share(self):
+        """
+        The rate is shared by the threads that use the marketplace
+        """
+        self.admission.bucket()
+        other = Thread(target=self.admission.bucket)
+        other.start()
+        other.join()
+        self.assertEqual([bucket.rate for bucket in self.admission.buckets.values()], [5, 5],
+                         "Each thread should get half of the rate!")
+
+        with self.admission.lock:
+            self.admission.share_rate()
+        self.assertEqual([bucket.rate for bucket in self.admission.buckets.values()], [10],
+                         "The bucket of the finished thread should be released!")
+
+    def test_token_bucket(self):
+        """
+        Only the failed retries use tokens, a consumer without tokens is busy
+        """
+        producer = self.admission.register_producer()
+        cart = self.admission.new_cart()
+        for _ in range(3):
+            self.admission.publish(producer, "oua")
+            self.assertTrue(self.admission.add_to_cart(cart, "oua"), "Successes are free!")
+
+        self.assertIs(self.admission.add_to_cart(cart, "ulei"), False, "First attempts are free!")
+        self.assertIs(self.admission.add_to_cart(cart, "ulei"), False, "Out of stock!")
+        self.assertIs(self.admission.add_to_cart(cart, "ulei"), False, "Out of stock!")
+        busy = self.admission.add_to_cart(cart, "ulei")
+        self.assertIsInstance(busy, Busy, "No tokens left!")
+        self.assertFalse(busy, "Busy is a failure too!")
+        self.assertAlmostEqual(busy.retry_after, 0.1, delta=0.02, msg="One token per 0.1 s!")
+
+        time.sleep(busy.retry_after)
+        self.assertIs(self.admission.add_to_cart(cart, "ulei"), False, "A token was added!")
+        self.assertEqual(self.admission.shed, 1, "One call was shed!")
+
+    def test_concurrency_limit(self):
+        """
+        A retry is busy while another retry is inside the marketplace, a first attempt is not
+        """
+        cart = self.admission.new_cart()
+        failed, retry = Event(), Event()
+
+        def add_twice():
+            self.admission.add_to_cart(cart, "oua")
+            failed.set()
+            retry.wait()
+            self.admission.add_to_cart(cart, "oua")
+
+        inside = Thread(target=add_twice)
+        inside.start()
+        failed.wait()
+        self.assertIs(self.admission.add_to_cart(cart, "oua"), False, "Out of stock!")
+        self.assertIs(self.admission.add_to_cart(cart, "oua"), False, "Out of stock!")
+        results = []
+        # A failed add_to_cart waits for the tracker's lock to record the demand
+        with self.marketplace.tracker.lock:
+            retry.set()
+            while not self.admission.inside:
+                time.sleep(0.001)
+            busy = self.admission.add_to_cart(cart, "oua")
+            self.assertIsInstance(busy, Busy, "The marketplace is saturated!")
+            self.assertEqual(busy.retry_after, self.admission.service_time,
+                             "Retry when the retry inside is likely to be done!")
+
+            first = Thread(target=lambda: results.append(self.admission.add_to_cart(cart, "oua")))
+            first.start()
+            first.join(0.1)
+            self.assertTrue(first.is_alive(), "A first attempt should get in!")
+        inside.join()
+        first.join()
+        self.assertEqual(results, [False], "Out of stock, not busy!")
+
+
+class Busy:
+    """
+    Result of a call turned away by the admission control. It is false, like an
+    out of stock result, but says how long to wait before retrying.
+    """
+    __slots__ = ("retry_after",)
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return f"Busy(retry_after={self.retry_after:.3f})"
+
+
+class TokenBucket:
+    """
+    rate tokens per second, at most burst of them. Only used by its consumer's thread
+    (the AdmissionControl may change the rate).
+    """
+    __slots__ = ("rate", "burst", "tokens", "updated", "retrying")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # True while the last call of the thread failed (its next call is a retry)
+        self.retrying = False
+
+    def take(self):
+        """
+        Takes a token. Returns 0 on success, else the seconds until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        return 0
+
+    def refund(self):
+        """
+        Gives back the token of a call that succeeded.
+        """
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class AdmissionControl:
+    """
+    Wraps a marketplace and sheds the add_to_cart calls that consumers retry in a loop
+    when the marketplace is saturated. A first attempt (the last call of the thread
+    succeeded) always goes through, only the retries are limited:
+      * every consumer (thread) has a token bucket: a retry takes a token and gives it
+        back if it succeeds, so only the failed retries are limited. The buckets of the
+        running threads share rate equally, so the failed retries do not grow with the
+        number of consumers (they would take the CPU away from the producers and the
+        successful calls). The bucket of a finished thread is released and its share
+        goes to the others;
+      * at most max_concurrent retries are inside the marketplace at once. Another
+        retry is told to come back when one of them is likely to be done (the average
+        time a retry spends inside the marketplace).
+    A shed call returns a Busy result right away. The other methods are the wrapped
+    ones: new_cart, remove_from_cart and place_order free resources and publish
+    brings the units the consumers wait for, shedding them would only slow the run.
+    """
+
+    def __init__(self, marketplace, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_concurrent=DEFAULT_MAX_CONCURRENT):
+
+        """
+        Constructor
+
+        :type marketplace: Marketplace
+        :param marketplace: the protected marketplace
+
+        :type rate: Float
+        :param rate: the failed calls allowed per second, shared by all the threads
+
+        :type burst: Int
+        :param burst: the failed calls a thread may make in a row
+
+        :type max_concurrent: Int
+        :param max_concurrent: the retries allowed inside the marketplace at the same time
+        """
+
+        self.marketplace = marketplace
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        # Number of retries inside the marketplace
+        self.inside = 0
+        # thread -> TokenBucket
+        self.buckets = {}
+        # When the rate was last shared between the buckets (time.monotonic())
+        self.shared = 0.0
+        # Average seconds a retry spends inside the marketplace. Only a hint, updated
+        # without the lock
+        self.service_time = 0.0
+        # Number of calls turned away
+        self.shed = 0
+        # Guards the buckets, the retries inside and the shed counter
+        self.lock = Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.marketplace, name)
+
+    def bucket(self):
+        """
+        Returns the token bucket of the calling thread.
+        """
+        thread = current_thread()
+        bucket = self.buckets.get(thread)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets[thread] = TokenBucket(self.rate, self.burst)
+                self.share_rate()
+        return bucket
+
+    def share_rate(self):
+        """
+        Releases the buckets of the finished threads and shares the rate equally
+        between the others. Called with the lock held.
+        """
+        for thread in [thread for thread in self.buckets if not thread.is_alive()]:
+            del self.buckets[thread]
+        for bucket in self.buckets.values():
+            bucket.rate = self.rate / len(self.buckets)
+        self.shared = time.monotonic()
+
+    def admit(self, method, *args):
+        """
+        Calls the method if it is a first attempt, or a retry for which the caller has
+        a token and a slot is free, otherwise returns Busy.
+        """
+        bucket = self.bucket()
+        if not bucket.retrying:
+            # a first attempt always goes in, without a token or a slot
+            result = method(*args)
+            bucket.retrying = not result
+            return result
+        retry_after = bucket.take()
+        with self.lock:
+            if not retry_after and self.inside >= self.max_concurrent:
+                # come back when a retry inside the marketplace is likely to be done
+                bucket.refund()
+                retry_after = self.service_time or 1 / bucket.rate
+            if not retry_after:
+                self.inside += 1
+        if retry_after:
+            with self.lock:
+                self.shed += 1
+                # the threads that finished since the last time leave their share to the others
+                if time.monotonic() - self.shared >= SHARE_INTERVAL:
+                    self.share_rate()
+            return Busy(retry_after)
+        start = time.perf_counter()
+        try:
+            result = method(*args)
+        finally:
+            with self.lock:
+                self.inside -= 1
+        self.service_time += (time.perf_counter() - start - self.service_time) * \
+            SERVICE_TIME_WEIGHT
+        if result:
+            bucket.refund()
+        bucket.retrying = not result
+        return result
+
+    def add_to_cart(self, cart_id, product):
+        """
+        See Marketplace.add_to_cart.
+        """
+        return self.admit(self.marketplace.add_to_cart, cart_id, product)
@@ -0,0 +1,237 @@
+"""
+This module represents the static analysis of a scenario (an .in file): it decides,
+from the supply, the demand and queue_size_per_producer, whether all the carts
+can be completed, before running anything.
+
+Usage: python3 -m tema.analyzer [--legacy] file.in [file.in ...]
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import json
+import sys
+import unittest
+from collections import Counter
+from dataclasses import dataclass, field
+
+COMPLETES = "completes"
+MAY_STALL = "may stall"
+DEADLOCKS = "deadlocks"
+
+
+class TestAnalyzer(unittest.TestCase):
+    """
+    Checks the verdicts on small scenarios.
+    """
+    @staticmethod
+    def scenario(producers, carts, queue_size=2):
+        """
+        Builds a scenario with a consumer per cart, from [products] per producer
+        and [(type, product, quantity)] per cart
+        """
+        return {
+            "producers": [{"name": f"prod{i + 1}", "products": [[product, 2, 0.1]
+                                                                 for product in products],
+                           "republish_wait_time": 0.1}
+                          for i, products in enumerate(producers)],
+            "consumers": [{"name": f"cons{i + 1}", "retry_wait_time": 0.1,
+                           "carts": [[{"type": kind, "product": product, "quantity": quantity}
+                                      for kind, product, quantity in cart]]}
+                          for i, cart in enumerate(carts)],
+            "marketplace": {"queue_size_per_producer": queue_size},
+        }
+
+    def test_unsupplied(self):
+        """
+        A product nobody produces can never be added
+        """
+        analysis = analyze(self.scenario([["id1"]], [[("add", "id1", 1), ("add", "id2", 1)]]))
+        self.assertEqual(analysis.verdict, DEADLOCKS, "Nobody produces id2!")
+        self.assertEqual(analysis.unsupplied, {"id2": ["cons1"]}, "Wrong diagnostic!")
+
+    def test_single_product_producers(self):
+        """
+        A producer's queue can only fill up with the one product it makes
+        """
+        scenario = self.scenario([["id1"], ["id2"], ["id2"]],
+                                 [[("add", "id1", 3), ("add", "id2", 2), ("remove", "id2", 1)]])
+        self.assertEqual(analyze(scenario).verdict, COMPLETES, "Should complete!")
+        self.assertEqual(analyze(scenario, demand_driven=False).verdict, COMPLETES,
+                         "Should complete!")
+
+    def test_surplus(self):
+        """
+        The queue of a producer of two products can fill up with the one that is not needed
+        """
+        scenario = self.scenario([["id1", "id2"]], [[("add", "id2", 1), ("add", "id1", 1)]])
+        self.assertEqual(analyze(scenario).verdict, COMPLETES, "No surplus is possible!")
+        legacy = analyze(scenario, demand_driven=False)
+        self.assertEqual(legacy.verdict, MAY_STALL, "The queue can fill up with id1!")
+        self.assertEqual(legacy.at_risk, {"id1": ["prod1"], "id2": ["prod1"]}, "Wrong products!")
+
+        # units put back by remove_from_cart are a surplus for the producers too
+        scenario = self.scenario([["id1", "id2"]], [[("add", "id1", 1), ("remove", "id1", 1),
+                                                     ("add", "id2", 1)]])
+        self.assertEqual(analyze(scenario).at_risk, {"id2": ["prod1"]}, "id1 may be left over!")
+        scenario["marketplace"]["queue_size_per_producer"] = 3
+        self.assertEqual(analyze(scenario).verdict, COMPLETES, "The queue has room for id2!")
+
+
+@dataclass(init=True, repr=True, order=False, frozen=False)
+class Analysis:
+    """
+    The verdict on a scenario and what it is based on.
+    """
+    verdict: str = COMPLETES
+    # product -> units added to carts by all the consumers
+    demand: dict = field(default_factory=dict)
+    # product -> consumers that need it although nobody produces it
+    unsupplied: dict = field(default_factory=dict)
+    # product -> its producers, when each of them may end up with a queue full of
+    # units nobody takes (and then never publishes this product again)
+    at_risk: dict = field(default_factory=dict)
+
+    def describe(self):
+        """
+        Returns the diagnostic as text.
+        """
+        lines = [self.verdict]
+        for product, consumers in sorted(self.unsupplied.items()):
+            lines.append(f"    {product} is never produced, needed by {', '.join(consumers)}")
+        for product, producers in sorted(self.at_risk.items()):
+            lines.append(f"    {product}: the queues of {', '.join(producers)} may fill up "
+                         f"with other products")
+        return "\n".join(lines)
+
+
+def gather_demand(config):
+    """
+    Returns the units of each product added to the carts, the consumers that add
+    each product (once per operation) and the units of each product removed from the carts.
+    """
+    demand = {}
+    consumers_of = {}
+    removed = Counter()
+    for consumer in config["consumers"]:
+        for cart in consumer["carts"]:
+            for operation in cart:
+                if operation["type"] == "add":
+                    demand[operation["product"]] = \
+                        demand.get(operation["product"], 0) + operation["quantity"]
+                    consumers_of.setdefault(operation["product"], []).append(consumer["name"])
+                else:
+                    removed[operation["product"]] += operation["quantity"]
+    return demand, consumers_of, removed
+
+
+def gather_supply(config):
+    """
+    Returns the producers of each product.
+    """
+    producers_of = {}
+    for producer in config["producers"]:
+        for product in producer["products"]:
+            producers_of.setdefault(product[0], []).append(producer["name"])
+    return producers_of
+
+
+def analyze(config, demand_driven=True):
+    """
+    Decides whether all the carts of the scenario can be completed.
+
+    A product that is added to a cart but never produced blocks its consumer
+    forever (DEADLOCKS). Otherwise the producers never run out of a product, so
+    a consumer can only wait forever if every producer of a product it needs
+    is stuck with a full queue of units that no cart will take (MAY_STALL,
+    depending on the interleaving). Such a surplus appears when:
+      * a producer cycles through its products regardless of the demand
+        (demand_driven=False, e.g. with a remote marketplace): its queue fills
+        up with the products nobody asks for anymore;
+      * with demand driven producers, several producers publish the same missing
+        unit at once, or a unit is put back by remove_from_cart while a producer
+        publishes it. No unit is published while there is a surplus, so a producer
+        holds at most one batch of it (quantity units, no more than the carts
+        that may wait for the product plus the units put back): it is stuck only
+        if these batches of its other products fill its queue.
+    A producer of a single product only blocks itself once that product is not needed.
+
+    :type config: Dict
+    :param config: the parsed .in file (products are referred to by id)
+
+    :type demand_driven: Boolean
+    :param demand_driven: True if the producers only publish what is wanted (see Producer.run)
+
+    :returns an Analysis
+    """
+    demand, consumers_of, removed = gather_demand(config)
+    producers_of = gather_supply(config)
+    analysis = Analysis(demand=demand)
+
+    for product, consumers in consumers_of.items():
+        if product not in producers_of:
+            analysis.unsupplied[product] = sorted(set(consumers))
+
+    queue_size = config["marketplace"]["queue_size_per_producer"]
+
+    def surplus(product, quantity):
+        """
+        The units of the product that may be left over in the queue of one of its producers.
+        """
+        if not demand_driven:
+            # the producer never stops publishing it
+            return queue_size
+        if len(producers_of[product]) == 1 and removed[product] == 0:
+            return 0
+        return min(quantity, len(set(consumers_of.get(product, []))) + removed[product])
+
+    surplus_of = {producer["name"]: {product: surplus(product, quantity)
+                                     for product, quantity, _ in producer["products"]}
+                  for producer in config["producers"]}
+    for product, producers in producers_of.items():
+        if product not in analysis.demand:
+            continue
+        # A surplus of the product itself is taken by the carts that need it
+        if all(sum(units for other, units in surplus_of[producer].items()
+                   if other != product) >= queue_size for producer in producers):
+            analysis.at_risk[product] = producers
+
+    if analysis.unsupplied:
+        analysis.verdict = DEADLOCKS
+    elif analysis.at_risk:
+        analysis.verdict = MAY_STALL
+    return analysis
+
+
+def analyze_file(path, demand_driven=True):
+    """
+    Analyzes the scenario of an .in file.
+    """
+    with open(path, encoding="utf-8") as input_file:
+        return analyze(json.load(input_file), demand_driven)
+
+
+def main():
+    """
+    Prints the verdict of each .in file given on the command line, exits with
+    status 1 if one of them deadlocks.
+    """
+    parser = argparse.ArgumentParser(description="Checks whether all the carts can complete")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--legacy", action="store_true",
+                        help="producers cycle through their products regardless of the demand")
+    arguments = parser.parse_args()
+
+    status = 0
+    for path in arguments.files:
+        analysis = analyze_file(path, not arguments.legacy)
+        print(f"{path}: {analysis.describe()}")
+        if analysis.verdict == DEADLOCKS:
+            status = 1
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+This module represents the Marketplace client: it exposes the same methods as the
+Marketplace, but executes them on a MarketplaceServer running in another process.
+Producer and Consumer can use it unchanged.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import socket
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+from threading import BoundedSemaphore, Lock, current_thread
+
+from tema.protocol import (REQUEST_HEADER, RESPONSE_HEADER, ID, TWO_IDS, BOOL,
+                           OP_SET_NAME, OP_INTERN, OP_LOOKUP, OP_REGISTER_PRODUCER, OP_PUBLISH,
+                           OP_NEW_CART, OP_ADD_TO_CART, OP_REMOVE_FROM_CART, OP_PLACE_ORDER,
+                           STATUS_OK, encode_frame, decode_frames,
+                           encode_product, decode_product, decode_ids)
+
+RECV_SIZE = 1 << 16
+DEFAULT_MAX_CONNECTIONS = 64
+
+
+class MarketplaceError(RuntimeError):
+    """
+    Raised when the hosted marketplace raised an exception while executing a request.
+    """
+
+
+class Connection:
+    """
+    One connection to the server. It remembers the thread name it last sent,
+    so OP_SET_NAME is only needed when a different thread uses it.
+    """
+
+    def __init__(self, socket_path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.name = None
+        self.buffer = bytearray()
+
+    def call(self, requests):
+        """
+        Sends all the request frames with a single write and returns their
+        responses, as a list of (status, payload), in the same order.
+        """
+        name = current_thread().name
+        if name != self.name:
+            requests = [encode_frame(REQUEST_HEADER, OP_SET_NAME, name.encode())] + requests
+        self.socket.sendall(b"".join(requests))
+
+        responses = []
+        while len(responses) < len(requests):
+            frames, consumed = decode_frames(self.buffer, RESPONSE_HEADER,
+                                             len(requests) - len(responses))
+            del self.buffer[:consumed]
+            responses += frames
+            if len(responses) < len(requests):
+                chunk = self.socket.recv(RECV_SIZE)
+                if not chunk:
+                    raise ConnectionError("The marketplace server closed the connection")
+                self.buffer += chunk
+
+        if name != self.name:
+            self.name = name
+            responses = responses[1:]
+        return responses
+
+    def close(self):
+        """
+        Closes the socket.
+        """
+        self.socket.close()
+
+
+class Requests(ABC):
+    """
+    The Marketplace methods, turned into requests. Subclasses decide whether a
+    request is executed right away (MarketplaceClient) or queued (Pipeline).
+    """
+
+    @abstractmethod
+    def submit(self, opcode, payload, decode):
+        """
+        Executes or queues a request.
+
+        :type decode: Function
+        :param decode: turns the response payload into the method's result
+        """
+
+    @abstractmethod
+    def product_id(self, product):
+        """
+        Returns the server side id of the product.
+        """
+
+    def register_producer(self):
+        """
+        See Marketplace.register_producer.
+        """
+        return self.submit(OP_REGISTER_PRODUCER, b"", decode_id)
+
+    def publish(self, producer_id, product):
+        """
+        See Marketplace.publish.
+        """
+        return self.submit(OP_PUBLISH, TWO_IDS.pack(int(producer_id), self.product_id(product)),
+                           decode_bool)
+
+    def new_cart(self):
+        """
+        See Marketplace.new_cart.
+        """
+        return self.submit(OP_NEW_CART, b"", decode_id)
+
+    def add_to_cart(self, cart_id, product):
+        """
+        See Marketplace.add_to_cart.
+        """
+        return self.submit(OP_ADD_TO_CART, TWO_IDS.pack(cart_id, self.product_id(product)),
+                           decode_bool)
+
+    def remove_from_cart(self, cart_id, product):
+        """
+        See Marketplace.remove_from_cart.
+        """
+        return self.submit(OP_REMOVE_FROM_CART, TWO_IDS.pack(cart_id, self.product_id(product)),
+                           decode_none)
+
+    def place_order(self, cart_id):
+        """
+        See Marketplace.place_order.
+        """
+        return self.submit(OP_PLACE_ORDER, ID.pack(cart_id), self.decode_order)
+
+    @abstractmethod
+    def decode_order(self, payload):
+        """
+        Turns the ids of an OP_PLACE_ORDER response into products.
+        """
+
+
+def decode_id(payload):
+    """
+    Response payload of the requests returning an id.
+    """
+    return ID.unpack(payload)[0]
+
+
+def decode_bool(payload):
+    """
+    Response payload of the requests returning True or False.
+    """
+    return BOOL.unpack(payload)[0]
+
+
+def decode_none(_):
+    """
+    Response payload of the requests returning nothing.
+    """
+    return None
+
+
+class MarketplaceClient(Requests):
+    """
+    Same methods as the Marketplace, executed by a MarketplaceServer. Connections
+    are pooled: a call borrows an idle connection (or opens a new one, up to
+    max_connections) and gives it back when the response arrives.
+    """
+
+    def __init__(self, socket_path, max_connections=DEFAULT_MAX_CONNECTIONS):
+
+        """
+        Constructor
+
+        :type socket_path: String
+        :param socket_path: the Unix domain socket of the server
+
+        :type max_connections: Int
+        :param max_connections: the maximum number of connections opened at the same time
+        """
+
+        self.socket_path = socket_path
+        self.idle_connections = LifoQueue()
+        self.connections_semaphore = BoundedSemaphore(max_connections)
+
+        # Products known by this client: product -> id and id -> product
+        self.product_ids = {}
+        self.products = {}
+        self.products_lock = Lock()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a connection from the pool.
+        """
+        with self.connections_semaphore:
+            try:
+                connection = self.idle_connections.get_nowait()
+            except Empty:
+                connection = Connection(self.socket_path)
+            try:
+                yield connection
+            except BaseException:
+                # the state of the connection is unknown, do not reuse it
+                connection.close()
+                raise
+            self.idle_connections.put(connection)
+
+    def execute(self, requests):
+        """
+        Sends the (opcode, payload, decode) requests in one batch and returns their results.
+        """
+        with self.connection() as connection:
+            responses = connection.call([encode_frame(REQUEST_HEADER, opcode, payload)
+                                         for opcode, payload, _ in requests])
+
+        results = []
+        for (_, _, decode), (status, payload) in zip(requests, responses):
+            if status != STATUS_OK:
+                raise MarketplaceError(payload.decode())
+            results.append(decode(payload))
+        return results
+
+    def submit(self, opcode, payload, decode):
+        return self.execute([(opcode, payload, decode)])[0]
+
+    def product_id(self, product):
+        product_id = self.product_ids.get(product)
+        if product_id is None:
+            product_id = self.submit(OP_INTERN, encode_product(product), decode_id)
+            with self.products_lock:
+                self.product_ids[product] = product_id
+                self.products[product_id] = product
+        return product_id
+
+    def product(self, product_id):
+        """
+        Returns the product with the given server side id.
+        """
+        product = self.products.get(product_id)
+        if product is None:
+            product = self.submit(OP_LOOKUP, ID.pack(product_id), decode_product)
+            with self.products_lock:
+                self.product_ids[product] = product_id
+                self.products[product_id] = product
+        return product
+
+    def decode_order(self, payload):
+        return [self.product(product_id) for product_id in decode_ids(payload)]
+
+    def pipeline(self):
+        """
+        Returns a Pipeline: the calls made on it are sent together when it is executed.
+        """
+        return Pipeline(self)
+
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+        while True:
+            try:
+                self.idle_connections.get_nowait().close()
+            except Empty:
+                return
+
+
+class Pipeline(Requests):
+    """
+    Queues Marketplace calls and sends them in a single batch on execute() (or
+    when used as a context manager, on exit). The results are in self.results.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def submit(self, opcode, payload, decode):
+        self.requests.append((opcode, payload, decode))
+
+    def product_id(self, product):
+        return self.client.product_id(product)
+
+    def decode_order(self, payload):
+        return self.client.decode_order(payload)
+
+    def execute(self):
+        """
+        Sends the queued requests and returns their results.
+        """
+        self.results = self.client.execute(self.requests) if self.requests else []
+        self.requests = []
+        return self.results
@@ -8,6 +8,44 @@ March 2021
 
 from threading import Thread
 import time
+import unittest
+
+from tema.admission import Busy
+from tema.marketplace import Marketplace
+from tema.plan import ADD, REMOVE, CartPlan, PlanCompiler, compile_carts
+from tema.product import Tea
+
+
+class TestConsumer(unittest.TestCase):
+    """
+    Runs a consumer with a compiled plan.
+    """
+    def test_plan(self):
+        """
+        The adjacent add and remove of a product are merged, the carts are ordered
+        with their net quantities
+        """
+        marketplace = Marketplace(10)
+        producer = marketplace.register_producer()
+        tea = Tea(name="Linden", price=9, type="Herbal")
+        for product in ["oua", "oua", "oua", tea, tea]:
+            marketplace.publish(producer, product)
+
+        plan = PlanCompiler().compile([
+            [{"type": "add", "product": "id1", "quantity": 2},
+             {"type": "remove", "product": "id1", "quantity": 1},
+             {"type": "add", "product": "id2", "quantity": 2}],
+            [{"type": "add", "product": "id1", "quantity": 2}]], {"id1": "oua", "id2": tea})
+        self.assertEqual(plan.carts[0], ((ADD, 0, 1), (ADD, 1, 2)), "Add 2, remove 1 = add 1!")
+
+        orders = []
+        marketplace.sinks.output = orders.append
+        consumer = Consumer(plan, marketplace, 0.01, name="cons1", daemon=True)
+        consumer.start()
+        consumer.join(5)
+        self.assertFalse(consumer.is_alive(), "The consumer should have ordered both carts!")
+        self.assertEqual(sorted(orders), [f"cons1 bought {tea}"] * 2 + ["cons1 bought oua"] * 3,
+                         "Wrong orders!")
 
 
 class Consumer(Thread):
@@ -19,8 +57,8 @@ class Consumer(Thread):
         """
         Constructor.
 
-        :type carts: List
-        :param carts: a list of add and remove operations
+        :type carts: List or CartPlan
+        :param carts: a list of add and remove operations, or their compiled plan
 
         :type marketplace: Marketplace
         :param marketplace: a reference to the marketplace
@@ -33,28 +71,34 @@ class Consumer(Thread):
         :param kwargs: other arguments that are passed to the Thread's __init__()
         """
         Thread.__init__(self, **kwargs)
-        self.carts = carts
+        self.plan = carts if isinstance(carts, CartPlan) else compile_carts(carts)
         self.marketplace = marketplace
         self.retry_wait_time = retry_wait_time
 
     def run(self):
-        for cart in self.carts:
+        products = self.plan.products
+        new_cart = self.marketplace.new_cart
+        add_to_cart = self.marketplace.add_to_cart
+        remove_from_cart = self.marketplace.remove_from_cart
+        for cart in self.plan.carts:
             # For each cart get a new id
-            cart_id = self.marketplace.new_cart()
-            for elements in cart:
-                # For each product try to add or remove it from the cart
-                quantity_so_far = 0
-                while quantity_so_far < elements["quantity"]:
-                    if elements["type"] == "remove":
-                        self.marketplace.remove_from_cart(cart_id, elements["product"])
-                        quantity_so_far += 1
-                        continue
+            cart_id = new_cart()
+            for opcode, product_id, quantity in cart:
+                product = products[product_id]
+                if opcode is REMOVE:
+                    for _ in range(quantity):
+                        remove_from_cart(cart_id, product)
+                    continue
 
-                    if elements["type"] == "add":
-                        if self.marketplace.add_to_cart(cart_id, elements["product"]):
-                            quantity_so_far += 1
-                            continue
-                        # Sleep if failed to add and retry next iteration
-                        time.sleep(self.retry_wait_time)
+                # Add the units one by one
+                while quantity:
+                    added = add_to_cart(cart_id, product)
+                    if added:
+                        quantity -= 1
+                        continue
+                    # Sleep if failed to add (as long as asked if the marketplace is busy)
+                    # and retry next iteration
+                    time.sleep(added.retry_after if isinstance(added, Busy)
+                               else self.retry_wait_time)
             # Order the products
             self.marketplace.place_order(cart_id)
@@ -0,0 +1,278 @@
+"""
+This module represents the read-only views of the Marketplace's inventory,
+memory usage and blocked carts, and the tracker that keeps the inventory
+snapshot and the demand of the carts up to date.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+from dataclasses import dataclass, field
+from threading import Lock, local
+from types import MappingProxyType
+
+EMPTY = MappingProxyType({})
+
+
+@dataclass(init=True, repr=True, order=False, frozen=True)
+class InventorySnapshot:
+    """
+    Immutable, consistent view of the marketplace at a given version (see
+    InventoryCounters), so readers never see a half applied update.
+    """
+    version: int = 0
+    # product -> number of units that can be added to a cart
+    stock: MappingProxyType = field(default_factory=lambda: EMPTY)
+    # producer id -> number of occupied slots in its queue
+    queue_fill: MappingProxyType = field(default_factory=lambda: EMPTY)
+    # number of carts that were created but not ordered yet
+    open_carts: int = 0
+
+
+@dataclass(init=True, repr=True, order=False, frozen=True)
+class MemoryStats:
+    """
+    Memory used by the Marketplace's structures. The products themselves are shared
+    by all the structures (only references are stored), so they are not counted.
+    """
+    units_in_stock: int
+    units_in_queues: int
+    units_in_carts: int
+    open_carts: int
+    # structure name -> bytes used by its containers (sys.getsizeof)
+    bytes_per_structure: MappingProxyType
+
+    @property
+    def total_bytes(self):
+        """
+        Bytes used by all the structures.
+        """
+        return sum(self.bytes_per_structure.values())
+
+    @property
+    def bytes_per_unit(self):
+        """
+        Bytes used by the stock and the producers' queues, per unit in stock.
+        """
+        inventory = self.bytes_per_structure["stock"] + \
+            self.bytes_per_structure["producers_queues"]
+        return inventory / self.units_in_stock if self.units_in_stock else 0.0
+
+    @property
+    def bytes_per_cart(self):
+        """
+        Bytes used by the carts, per open cart.
+        """
+        return self.bytes_per_structure["carts"] / self.open_carts if self.open_carts else 0.0
+
+
+@dataclass(init=True, repr=True, order=False, frozen=True)
+class StallReport:
+    """
+    What the marketplace is waiting for when no cart makes progress.
+    """
+    # number of successful cart operations so far
+    progress: int
+    # cart id -> (consumer, product its last add_to_cart did not find)
+    blocked_carts: MappingProxyType
+    # producer id -> product -> units, for the queues with no empty slot
+    full_queues: MappingProxyType
+    open_carts: int
+    # product -> units, when max_units is reached (bounded mode), else None
+    full_stock: MappingProxyType = None
+
+    def describe(self, producer_names=None):
+        """
+        Returns the diagnostic as text.
+
+        :type producer_names: Dict
+        :param producer_names: producer id -> name, to show names instead of ids
+        """
+        producer_names = producer_names or {}
+        lines = [f"no progress after {self.progress} cart operations, "
+                 f"{self.open_carts} open carts"]
+        for cart_id, (consumer, product) in sorted(self.blocked_carts.items()):
+            lines.append(f"    {consumer} (cart {cart_id}) waits for {product}")
+        for producer_id, products in sorted(self.full_queues.items()):
+            contents = ", ".join(f"{units} x {product}" for product, units in products.items())
+            lines.append(f"    queue of {producer_names.get(producer_id, producer_id)} "
+                         f"is full: {contents}")
+        if self.full_stock is not None:
+            contents = ", ".join(f"{units} x {product}"
+                                 for product, units in self.full_stock.items())
+            lines.append(f"    the stock is full (max_units): {contents}")
+        return "\n".join(lines)
+
+
+class InventoryCounters:
+    """
+    The counters behind the inventory snapshots. The writers update them in O(1) with
+    lock held. A snapshot is built (O(products + producers)) only when a reader asks for
+    a version that was not built yet, and is reused until the next change.
+    """
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.version = 0
+        # Units in stock, of all the products (checked against max_units)
+        self.units = 0
+        # product -> units in stock (only the products with units)
+        self.stock = {}
+        # producer id -> occupied slots in its queue
+        self.queue_fill = {}
+        self.open_carts = 0
+        # The latest snapshot built
+        self.built = InventorySnapshot()
+
+    def update(self, product=None, stock_delta=0, producer_id=None, fill_delta=0,
+               carts_delta=0):
+
+        """
+        Applies a change and starts a new version. Called with the lock held.
+
+        :type product: Product
+        :param product: the product whose stock changes by stock_delta
+
+        :type producer_id: Int
+        :param producer_id: the producer whose queue fill changes by fill_delta
+
+        :type carts_delta: Int
+        :param carts_delta: the change in the number of open carts
+        """
+
+        if product is not None:
+            units = self.stock.get(product, 0) + stock_delta
+            if units > 0:
+                self.stock[product] = units
+            else:
+                self.stock.pop(product, None)
+            self.units += stock_delta
+        if producer_id is not None:
+            self.queue_fill[producer_id] = self.queue_fill.get(producer_id, 0) + fill_delta
+        self.open_carts += carts_delta
+        self.version += 1
+
+    def snapshot(self):
+
+        """
+        Returns the snapshot of the current version. Without a change since the last
+        call, it returns the same snapshot without taking the lock.
+        """
+
+        built = self.built
+        if built.version == self.version:
+            return built
+        with self.lock:
+            if self.built.version != self.version:
+                self.built = InventorySnapshot(self.version,
+                                               MappingProxyType(dict(self.stock)),
+                                               MappingProxyType(dict(self.queue_fill)),
+                                               self.open_carts)
+            return self.built
+
+
+class DemandTracker:
+    """
+    What the Marketplace's readers and producers look at: the inventory counters,
+    the product each open cart waits for and the progress of the carts. Everything
+    is changed with lock held, by every operation but only for O(1) work.
+    """
+
+    def __init__(self):
+
+        """
+        Constructor
+        """
+
+        self.lock = Lock()
+        # Stock, queue fill and open carts. Readers get their snapshots without the lock
+        # as long as nothing changed
+        self.inventory = InventoryCounters(self.lock)
+        # The conditions of the producers waiting for demand, per product (product, {Condition})
+        self.watchers = {}
+        # The product each cart is waiting for (its last add_to_cart failed) (id_cart, product)
+        self.waiting_carts = {}
+        # Number of carts waiting for each product (product, count)
+        self.pending_demand = {}
+        # The consumer (thread name) of each cart not ordered yet (id_cart, name)
+        self.cart_owners = {}
+        # Number of successful cart operations, watched by the Watchdog
+        self.progress = 0
+        # Set by close(), when the producers are no longer needed
+        self.closed = False
+        # Number of the next operation, in the order the operations take effect, and the
+        # number of the last operation of each thread (see take_sequence)
+        self.sequence = 0
+        self.last = local()
+
+    def wait_for_product(self, cart_id, product):
+
+        """
+        Records that the cart waits for product (None if it does not wait anymore).
+        """
+
+        previous = self.waiting_carts.pop(cart_id, None)
+        if previous is not None:
+            self.pending_demand[previous] -= 1
+            if self.pending_demand[previous] == 0:
+                del self.pending_demand[previous]
+        if product is not None:
+            self.waiting_carts[cart_id] = product
+            self.pending_demand[product] = self.pending_demand.get(product, 0) + 1
+
+    def watch(self, products, wakeup):
+
+        """
+        Registers the condition of a producer, notified when the demand for one of the
+        products is not covered by the stock or when the run ends.
+
+        :type wakeup: Condition
+        :param wakeup: a condition of lock
+        """
+
+        for product in set(products):
+            self.watchers.setdefault(product, set()).add(wakeup)
+
+    def unwatch(self, products, wakeup):
+
+        """
+        Removes the condition registered by watch.
+        """
+
+        for product in set(products):
+            waiting = self.watchers[product]
+            waiting.discard(wakeup)
+            if not waiting:
+                del self.watchers[product]
+
+    def notify_watchers(self, product=None):
+
+        """
+        Wakes up the producers waiting for demand for the product (all of them for None).
+        """
+
+        if product is None:
+            wakeups = set().union(*self.watchers.values())
+        else:
+            wakeups = self.watchers.get(product, ())
+        for wakeup in wakeups:
+            wakeup.notify()
+
+    def take_sequence(self):
+
+        """
+        Numbers the operation of the calling thread. Called with lock held, by every
+        operation, where its result is decided.
+        """
+
+        self.last.sequence = self.sequence
+        self.sequence += 1
+
+    def unmet_demand(self, product):
+
+        """
+        Returns the number of waiting carts for the product minus the units in stock.
+        """
+
+        return self.pending_demand.get(product, 0) - self.inventory.stock.get(product, 0)
@@ -5,11 +5,18 @@ Computer Systems Architecture Course
 Assignment 1
 March 2021
 """
-import logging
+import os
+import sys
+import tempfile
 import time
 import unittest
-from threading import Lock, current_thread
-from logging.handlers import RotatingFileHandler
+from collections import Counter, deque
+from threading import Barrier, Condition, Lock, Thread, current_thread
+from types import MappingProxyType
+
+from tema.inventory import DemandTracker, MemoryStats, StallReport
+from tema.observability import MetricsCounter, Observability, Sinks
+from tema.orders import OrderHistory
 
 
 class TestMarketplace(unittest.TestCase):
@@ -135,6 +142,382 @@ class TestMarketplace(unittest.TestCase):
 
         self.assertEqual(self.marketplace.place_order(id0), ["oua", "ulei"], "Not the same!")
 
+    def test_order_history(self):
+        """
+        Check that every placed order is recorded in the order history
+        """
+        producer = self.marketplace.register_producer()
+        id0 = self.marketplace.new_cart()
+        id1 = self.marketplace.new_cart()
+        for product in ["oua", "oua", "ulei"]:
+            self.marketplace.publish(producer, product)
+        self.marketplace.add_to_cart(id0, "oua")
+        self.marketplace.add_to_cart(id0, "ulei")
+        self.marketplace.add_to_cart(id1, "oua")
+        self.marketplace.place_order(id0)
+        self.marketplace.place_order(id1)
+
+        history = self.marketplace.order_history
+        self.assertEqual(history.orders, 2, "Both orders should be recorded!")
+        self.assertEqual(history.units_per_product(), {"oua": 2, "ulei": 1}, "Wrong units!")
+        self.assertEqual(history.totals_per_consumer(), {current_thread().name: (3, 0)},
+                         "Wrong totals!")
+
+    def test_demand(self):
+        """
+        Check that failed additions are reported as demand until the stock covers them
+        """
+        producer = self.marketplace.register_producer()
+        id0 = self.marketplace.new_cart()
+        id1 = self.marketplace.new_cart()
+
+        self.assertFalse(self.marketplace.add_to_cart(id0, "oua"), "Nonexistent product")
+        self.assertFalse(self.marketplace.add_to_cart(id0, "oua"), "Nonexistent product")
+        self.assertFalse(self.marketplace.add_to_cart(id1, "oua"), "Nonexistent product")
+        self.assertEqual(self.marketplace.get_demand(), {"oua": 2}, "Two carts are waiting!")
+        self.assertEqual(self.marketplace.wait_for_demand(["ulei", "oua"]), {"oua": 2},
+                         "Two units are missing!")
+
+        self.marketplace.publish(producer, "oua")
+        self.assertEqual(self.marketplace.wait_for_demand(["oua"]), {"oua": 1},
+                         "One unit is missing!")
+        self.assertTrue(self.marketplace.add_to_cart(id0, "oua"), "Failed to add existent product!")
+        self.assertEqual(self.marketplace.get_demand(), {"oua": 1}, "One cart is waiting!")
+
+        self.marketplace.place_order(id1)
+        self.assertEqual(self.marketplace.get_demand(), {}, "No cart is waiting!")
+
+        self.marketplace.close()
+        self.assertIsNone(self.marketplace.wait_for_demand(["oua"]), "Should not block!")
+
+    def test_demand_per_product(self):
+        """
+        Check that a failed addition only wakes up the producers waiting for that product
+        """
+        id0 = self.marketplace.new_cart()
+        results = {}
+
+        def wait(products):
+            results[products[0]] = self.marketplace.wait_for_demand(products)
+
+        waiters = [Thread(target=wait, args=(products,))
+                   for products in (["oua"], ["ulei", "lapte"])]
+        for waiter in waiters:
+            waiter.start()
+        watchers = self.marketplace.tracker.watchers
+        while len(watchers) < 3:
+            time.sleep(0.001)
+        self.assertEqual(watchers["ulei"], watchers["lapte"], "Same producer!")
+        self.assertNotEqual(watchers["oua"], watchers["ulei"], "Other producer!")
+
+        self.assertFalse(self.marketplace.add_to_cart(id0, "oua"), "Nonexistent product")
+        waiters[0].join(1)
+        self.assertEqual(results, {"oua": {"oua": 1}}, "Only oua is wanted!")
+        self.assertNotIn("oua", watchers, "The producer returned!")
+
+        self.marketplace.close()
+        waiters[1].join(1)
+        self.assertIsNone(results["ulei"], "Woken up by close()!")
+        self.assertEqual(watchers, {}, "No producer is waiting!")
+
+    def test_bounded_mode(self):
+        """
+        Check that the caps on the stock and on the open carts are enforced
+        """
+        marketplace = Marketplace(3, max_units=2, max_open_carts=1)
+        producer0 = marketplace.register_producer()
+        producer1 = marketplace.register_producer()
+        self.assertTrue(marketplace.publish(producer0, "oua"), "Failed to publish!")
+        self.assertTrue(marketplace.publish(producer1, "oua"), "Failed to publish!")
+        self.assertFalse(marketplace.publish(producer1, "lapte"), "The stock is full!")
+
+        id0 = marketplace.new_cart()
+        marketplace.add_to_cart(id0, "oua")
+        self.assertTrue(marketplace.publish(producer1, "lapte"), "Failed to publish!")
+
+        waiting = Thread(target=marketplace.new_cart)
+        waiting.start()
+        waiting.join(0.1)
+        self.assertTrue(waiting.is_alive(), "Only one cart can be open!")
+        marketplace.place_order(id0)
+        waiting.join(1)
+        self.assertFalse(waiting.is_alive(), "The cart should have been created!")
+
+    def test_memory_stats(self):
+        """
+        Check the units and bytes reported for each structure
+        """
+        producer = self.marketplace.register_producer()
+        id0 = self.marketplace.new_cart()
+        self.marketplace.publish(producer, "oua")
+        self.marketplace.publish(producer, "ulei")
+        self.marketplace.add_to_cart(id0, "oua")
+
+        stats = self.marketplace.get_memory_stats()
+        self.assertEqual((stats.units_in_stock, stats.units_in_queues, stats.units_in_carts,
+                          stats.open_carts), (1, 1, 1, 1), "Wrong units!")
+        self.assertEqual(stats.total_bytes, sum(stats.bytes_per_structure.values()),
+                         "Wrong total!")
+        self.assertGreater(stats.bytes_per_unit, 0, "Units use memory!")
+        self.assertGreater(stats.bytes_per_cart, 0, "Carts use memory!")
+
+    def test_observability(self):
+        """
+        Check that each marketplace owns its log handler and that the sinks receive the events
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "marketplace.log")
+            lines = []
+            metrics = MetricsCounter()
+            marketplaces = [Marketplace(3, observability=Observability(
+                log_file=path, metrics=metrics, output=lines.append)) for _ in range(3)]
+            for marketplace in marketplaces:
+                self.assertEqual(len(marketplace.sinks.logger.handlers), 1, "Handlers accumulate!")
+
+            marketplace = marketplaces[-1]
+            producer = marketplace.register_producer()
+            id0 = marketplace.new_cart()
+            marketplace.publish(producer, "oua")
+            marketplace.add_to_cart(id0, "oua")
+            marketplace.add_to_cart(id0, "ulei")
+            marketplace.place_order(id0)
+            for marketplace in marketplaces:
+                marketplace.close()
+                self.assertTrue(marketplace.sinks.handler.stream is None,
+                                "The log file is still open!")
+
+            with open(path, encoding="utf-8") as log_file:
+                self.assertEqual(len(log_file.readlines()), 6, "Each call is logged once!")
+            self.assertEqual(lines, [f"{current_thread().name} bought oua"], "Wrong output!")
+            self.assertEqual(metrics.snapshot(),
+                             {"producers": 1, "carts": 1, "published": 1, "added_to_cart": 1,
+                              "add_to_cart_missing": 1, "orders": 1, "units_ordered": 1},
+                             "Wrong metrics!")
+
+        self.assertIsNone(self.marketplace.sinks.handler, "No I/O by default!")
+        self.assertIsNone(self.marketplace.sinks.output, "No I/O by default!")
+
+    def test_get_inventory(self):
+        """
+        Check that each snapshot reflects the changes made before taking it and no later ones
+        """
+        producer = self.marketplace.register_producer()
+        id0 = self.marketplace.new_cart()
+        self.marketplace.publish(producer, "oua")
+        self.marketplace.publish(producer, "oua")
+        self.marketplace.publish(producer, "ulei")
+        self.marketplace.add_to_cart(id0, "oua")
+
+        snapshot = self.marketplace.get_inventory()
+        self.assertEqual(dict(snapshot.stock), {"oua": 1, "ulei": 1}, "Wrong stock!")
+        self.assertEqual(dict(snapshot.queue_fill), {producer: 2}, "Wrong queue fill!")
+        self.assertEqual(snapshot.open_carts, 1, "Wrong number of open carts!")
+
+        self.marketplace.remove_from_cart(id0, "oua")
+        self.marketplace.place_order(id0)
+
+        self.assertEqual(snapshot.stock["oua"], 1, "Old snapshot should not change!")
+        newer = self.marketplace.get_inventory()
+        self.assertGreater(newer.version, snapshot.version, "Version not increased!")
+        self.assertEqual(newer.stock["oua"], 2, "Wrong stock!")
+        self.assertEqual(newer.open_carts, 0, "Wrong number of open carts!")
+        with self.assertRaises(TypeError):
+            newer.stock["oua"] = 0
+
+    def test_add_put_back_unit(self):
+        """
+        Adding a unit put back by remove_from_cart (no longer in any queue) lowers the stock
+        """
+        producer = self.marketplace.register_producer()
+        id0 = self.marketplace.new_cart()
+        self.marketplace.publish(producer, "oua")
+        self.marketplace.add_to_cart(id0, "oua")
+        self.marketplace.remove_from_cart(id0, "oua")
+        self.assertEqual(dict(self.marketplace.get_inventory().stock), {"oua": 1},
+                         "The unit was put back!")
+
+        self.assertTrue(self.marketplace.add_to_cart(id0, "oua"), "The unit is available!")
+        snapshot = self.marketplace.get_inventory()
+        self.assertEqual(dict(snapshot.stock), {}, "The unit was added again!")
+        self.assertEqual(dict(snapshot.queue_fill), {producer: 0}, "Wrong queue fill!")
+
+
+class TestMarketplaceConcurrency(unittest.TestCase):
+    """
+    Stress test: producers and consumers use the same marketplace at the same time.
+    Run it with the GIL disabled as well (PYTHON_GIL=0 on a free-threaded build,
+    e.g. python3.13t -m unittest tema.marketplace) to check that nothing relies on it.
+    """
+    NUM_THREADS = 8
+    ITERATIONS = 500
+    PRODUCTS = ["branza", "oua", "lapte", "ulei"]
+
+    def setUp(self):
+        """
+        Create a marketplace with small queues, so that publish fails often
+        """
+        self.marketplace = Marketplace(2)
+        self.barrier = Barrier(2 * self.NUM_THREADS)
+        self.published = [Counter() for _ in range(self.NUM_THREADS)]
+        self.ordered = [Counter() for _ in range(self.NUM_THREADS)]
+
+    def produce(self, index):
+        """
+        Publishes all the products in a loop and counts the published units
+        """
+        producer = self.marketplace.register_producer()
+        self.barrier.wait()
+        for i in range(self.ITERATIONS):
+            product = self.PRODUCTS[(index + i) % len(self.PRODUCTS)]
+            if self.marketplace.publish(producer, product):
+                self.published[index][product] += 1
+            else:
+                # let the other threads run, the queue is full
+                time.sleep(0)
+
+    def consume(self, index):
+        """
+        Fills a cart, puts one product back and orders the cart, in a loop
+        """
+        self.barrier.wait()
+        for i in range(self.ITERATIONS):
+            cart = self.marketplace.new_cart()
+            for product in self.PRODUCTS:
+                self.marketplace.add_to_cart(cart, product)
+            self.marketplace.remove_from_cart(cart, self.PRODUCTS[i % len(self.PRODUCTS)])
+            self.ordered[index].update(self.marketplace.place_order(cart))
+            time.sleep(0)
+
+    def test_units_are_conserved(self):
+        """
+        Every published unit is either still available or was ordered exactly once
+        """
+        threads = [Thread(target=self.produce, args=(i,)) for i in range(self.NUM_THREADS)]
+        threads += [Thread(target=self.consume, args=(i,)) for i in range(self.NUM_THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        published = sum(self.published, Counter())
+        available = Counter(self.marketplace.products_avail)
+        self.assertEqual(published, available + sum(self.ordered, Counter()), "Units lost!")
+        self.assertEqual(self.marketplace.carts, {}, "All carts were ordered!")
+        self.assertEqual(self.marketplace.order_history.units_per_product(),
+                         dict(sum(self.ordered, Counter())), "Orders not recorded!")
+
+        queued = Counter()
+        for queue in self.marketplace.producers_queues.values():
+            self.assertLessEqual(len(queue), 2, "Queue overflow!")
+            queued.update(queue)
+        self.assertEqual(queued - available, Counter(), "Queued units must be available!")
+
+        snapshot = self.marketplace.get_inventory()
+        self.assertEqual(dict(snapshot.stock), dict(available), "Wrong snapshot stock!")
+        self.assertEqual(dict(snapshot.queue_fill),
+                         {key: len(queue) for key, queue
+                          in self.marketplace.producers_queues.items()}, "Wrong queue fill!")
+        self.assertEqual(snapshot.open_carts, 0, "Wrong number of open carts!")
+
+
+class Bounds:
+    """
+    The limits of a Marketplace: the size of each producer's queue and, in bounded
+    mode, the caps on the units in stock and on the carts not ordered yet.
+    """
+
+    def __init__(self, queue_size_per_producer, max_units, max_open_carts, cart_lock):
+
+        """
+        Constructor
+
+        :type cart_lock: Lock
+        :param cart_lock: the lock of the marketplace's carts, the one of the condition
+        """
+
+        # Maximum number of products a producer is allowed to have
+        self.queue_size_per_producer = queue_size_per_producer
+        self.max_units = max_units
+        self.max_open_carts = max_open_carts
+        # Signaled when a cart is ordered (bounded mode)
+        self.cart_ordered = Condition(cart_lock)
+
+    def queue_full(self, fill):
+
+        """
+        Returns True if a producer's queue with fill products has no empty slot.
+        """
+
+        return fill >= self.queue_size_per_producer
+
+    def stock_full(self, units):
+
+        """
+        Returns True if max_units units are in stock (always False in unbounded mode).
+        """
+
+        return self.max_units is not None and units >= self.max_units
+
+    def wait_for_cart_slot(self, carts):
+
+        """
+        Waits until fewer than max_open_carts carts are open (returns right away in
+        unbounded mode). Called with the cart lock held.
+        """
+
+        while self.max_open_carts is not None and len(carts) >= self.max_open_carts:
+            self.cart_ordered.wait()
+
+
+class ProductStock:
+    """
+    The units of one product that can be added to a cart. Its lock is only taken by the
+    operations on this product, so different products do not wait for each other.
+    """
+
+    def __init__(self):
+
+        """
+        Constructor
+        """
+
+        self.lock = Lock()
+        # The producer of each unit, oldest first (None for a unit put back by
+        # remove_from_cart, which is in no queue anymore)
+        self.suppliers = deque()
+
+    def add(self, producer_id=None):
+
+        """
+        Adds a unit published by the producer (None for a unit put back). Called with lock held.
+        """
+
+        self.suppliers.append(producer_id)
+
+    def take(self):
+
+        """
+        Removes the oldest unit and returns its producer. Called with lock held.
+        """
+
+        return self.suppliers.popleft()
+
+
+class ProducerQueue(list):
+    """
+    The products published by a producer and not added to a cart yet, with the lock
+    that guards them.
+    """
+
+    def __init__(self):
+
+        """
+        Constructor
+        """
+
+        super().__init__()
+        self.lock = Lock()
+
 
 class Marketplace:
     """
@@ -142,41 +525,114 @@ class Marketplace:
     The producers and consumers use its methods concurrently.
     """
 
-    def __init__(self, queue_size_per_producer):
+    def __init__(self, queue_size_per_producer, max_units=None, max_open_carts=None,
+                 observability=None, order_history=None):
 
         """
         Constructor
 
         :type queue_size_per_producer: Int
         :param queue_size_per_producer: the maximum size of a queue associated with each producer
+
+        :type max_units: Int
+        :param max_units: if set, publish fails while there are this many units in stock
+
+        :type max_open_carts: Int
+        :param max_open_carts: if set, new_cart waits while there are this many open carts
+
+        :type observability: Observability
+        :param observability: where the log, the metrics and the orders go (nowhere by default)
+
+        :type order_history: OrderHistory
+        :param order_history: where the placed orders are recorded (a new one in memory by default)
         """
 
-        # Maximum number of products a producer is allowed to have
-        self.queue_size_per_producer = queue_size_per_producer
-        # Internal counter used for assigning different id's to each producer
-        self.number_of_producers = 0
         # Internal counter used for assigning different id's to each cart
         self.number_of_carts = 0
 
-        # All the producers' queues
+        # All the producers' queues (id_producer, ProducerQueue)
         self.producers_queues = {}
-        # Products available in the marketplace
-        self.products_avail = []
-        # All the carts issued in the marketplace (id_cart, [products])
+        # Units available in the marketplace (product, ProductStock)
+        self.stock = {}
+        # All the carts issued in the marketplace (id_cart, [products]). A cart is only
+        # used by the consumer that created it, so its list needs no lock
         self.carts = {}
-
-        # Mutexes
+        # Every placed order, for the aggregate queries (revenue, units sold...)
+        self.order_history = order_history if order_history is not None else OrderHistory()
+
+        # Mutexes. Nothing relies on the GIL. The lock of a ProductStock is taken before
+        # the lock of a ProducerQueue or the tracker's lock. The tracker's lock is taken by
+        # every operation, but only for O(1) work: the caps are checked against its counters
+        # and the operations are numbered in the order they take effect.
+        # register_producer_lock guards producers_queues, register_cart_semaphore guards
+        # the carts dict
         self.register_producer_lock = Lock()
         self.register_cart_semaphore = Lock()
 
-        # Logger declarations
-        self.logger = logging.getLogger("myLogger")
-        self.handler = RotatingFileHandler('marketplace.log', maxBytes=25000, backupCount=10)
-        self.handler.setLevel(logging.INFO)
-        self.handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)8s: %(message)s'))
-        logging.Formatter.converter = time.gmtime
-        self.logger.setLevel(logging.INFO)
-        self.logger.addHandler(self.handler)
+        # Queue size and bounded mode caps
+        self.bounds = Bounds(queue_size_per_producer, max_units, max_open_carts,
+                             self.register_cart_semaphore)
+        # Inventory counters, demand of the waiting carts and progress
+        self.tracker = DemandTracker()
+        # Logger, metrics and output. The logger and its handler belong to this
+        # marketplace only, close() releases them
+        self.sinks = Sinks(observability)
+
+    @property
+    def number_of_producers(self):
+
+        """
+        The number of registered producers, also the id of the next one.
+        """
+
+        return len(self.producers_queues)
+
+    @property
+    def queue_size_per_producer(self):
+
+        """
+        The maximum size of a queue associated with each producer.
+        """
+
+        return self.bounds.queue_size_per_producer
+
+    @property
+    def products_avail(self):
+
+        """
+        The products available in the marketplace, one entry per unit, grouped by product.
+        """
+
+        with self.tracker.lock:
+            stocks = list(self.stock.items())
+        return [product for product, stock in stocks for _ in range(len(stock.suppliers))]
+
+    @property
+    def sequence(self):
+
+        """
+        The number the next operation will get (see last_sequence).
+        """
+
+        return self.tracker.sequence
+
+    @property
+    def progress(self):
+
+        """
+        The number of successful cart operations so far.
+        """
+
+        return self.tracker.progress
+
+    @property
+    def closed(self):
+
+        """
+        True after close().
+        """
+
+        return self.tracker.closed
 
     def register_producer(self):
 
@@ -185,15 +641,16 @@ class Marketplace:
         """
 
         with self.register_producer_lock:
-            # Get the next id for the new producer
-            id_producer = self.number_of_producers
-            # Add a new queue for the newly added producer
-            self.producers_queues[id_producer] = []
-            # Increment the number of producers
-            self.number_of_producers += 1
+            # Get the next id for the new producer and add its queue
+            id_producer = len(self.producers_queues)
+            self.producers_queues[id_producer] = ProducerQueue()
+            with self.tracker.lock:
+                self.tracker.inventory.update(producer_id=id_producer)
+                self.tracker.take_sequence()
             # Log that producer was issued a correct id
-            self.logger.info('Producer id returned: %d for thread %s',
-                             id_producer, current_thread().name)
+            self.sinks.logger.info('Producer id returned: %d for thread %s',
+                                   id_producer, current_thread().name)
+        self.sinks.count("producers")
 
         return id_producer
 
@@ -210,17 +667,32 @@ class Marketplace:
 
         :returns True or False. If the caller receives False, it should wait and then try again.
         """
-        # Check if there is still room in the producer's queue
-        if len(self.producers_queues[int(producer_id)]) < self.queue_size_per_producer:
-            self.logger.info('Producer %s with id %d published %s',
-                             current_thread().name, producer_id, product)
-            converted_id = int(producer_id)
-            # Append the product
-            self.producers_queues[converted_id].append(product)
-            self.products_avail.append(product)
-            return True
-
-        return False
+        converted_id = int(producer_id)
+        stock = self.stock_of(product)
+        with stock.lock:
+            with self.tracker.lock:
+                inventory = self.tracker.inventory
+                # Check if there is still room in the producer's queue (and in the marketplace)
+                rejected = self.bounds.queue_full(inventory.queue_fill[converted_id]) or \
+                    self.bounds.stock_full(inventory.units)
+                if not rejected:
+                    inventory.update(product=product, stock_delta=1,
+                                     producer_id=converted_id, fill_delta=1)
+                self.tracker.take_sequence()
+            if not rejected:
+                # Append the product
+                queue = self.producers_queues[converted_id]
+                with queue.lock:
+                    queue.append(product)
+                stock.add(converted_id)
+
+        if rejected:
+            self.sinks.count("publish_rejected")
+            return False
+        self.sinks.logger.info('Producer %s with id %d published %s',
+                               current_thread().name, producer_id, product)
+        self.sinks.count("published")
+        return True
 
     def new_cart(self):
 
@@ -231,14 +703,22 @@ class Marketplace:
         """
 
         with self.register_cart_semaphore:
+            # In bounded mode, wait for another consumer to place an order
+            self.bounds.wait_for_cart_slot(self.carts)
             # Get the current id
             id_cart = self.number_of_carts
-            self.logger.info('New_cart with id %d for consumer %s ',
-                             id_cart, current_thread().name)
+            self.sinks.logger.info('New_cart with id %d for consumer %s ',
+                                   id_cart, current_thread().name)
             # Add an empty cart (i.e. empty list)
             self.carts[id_cart] = []
             # Increment the number of carts to obtain the next id
             self.number_of_carts += 1
+            with self.tracker.lock:
+                self.tracker.cart_owners[id_cart] = current_thread().name
+                self.tracker.progress += 1
+                self.tracker.inventory.update(carts_delta=1)
+                self.tracker.take_sequence()
+        self.sinks.count("carts")
 
         return id_cart
 
@@ -256,21 +736,38 @@ class Marketplace:
         :returns True or False. If the caller receives False, it should wait and then try again
         """
 
-        with self.register_cart_semaphore:
-            self.logger.info('Product %s bought by consumer %s and added to cart %d',
-                             product, current_thread().name, cart_id)
-            # If product is not available we skip
-            if product not in self.products_avail:
-                return False
-            # Otherwise, we make it unavailable for other consumers and add it to our own cart
-            self.products_avail.remove(product)
-            self.carts[cart_id].append(product)
-            for prod_queue in self.producers_queues.values():
-                if product in prod_queue:
-                    # Remove the product from the producer's queue, so he can add other products
-                    prod_queue.remove(product)
-                    break
-        return True
+        self.sinks.logger.info('Product %s bought by consumer %s and added to cart %d',
+                               product, current_thread().name, cart_id)
+        stock = self.stock_of(product)
+        with stock.lock:
+            added = bool(stock.suppliers)
+            id_queue = None
+            if added:
+                # We make it unavailable for other consumers and add it to our own cart
+                id_queue = stock.take()
+                if id_queue is not None:
+                    # Remove the product from the producer's queue, so he can add others
+                    queue = self.producers_queues[id_queue]
+                    with queue.lock:
+                        queue.remove(product)
+                self.carts[cart_id].append(product)
+            with self.tracker.lock:
+                if added:
+                    self.tracker.wait_for_product(cart_id, None)
+                    self.tracker.progress += 1
+                    # A product put back by remove_from_cart is no longer in any queue
+                    self.tracker.inventory.update(product=product, stock_delta=-1,
+                                                  producer_id=id_queue, fill_delta=-1)
+                else:
+                    # If product is not available we skip, but let the producers know it is wanted
+                    self.tracker.wait_for_product(cart_id, product)
+                    if self.tracker.unmet_demand(product) > 0:
+                        # Only the producers of this product need to know
+                        self.tracker.notify_watchers(product)
+                self.tracker.take_sequence()
+
+        self.sinks.count("added_to_cart" if added else "add_to_cart_missing")
+        return added
 
     def remove_from_cart(self, cart_id, product):
 
@@ -283,12 +780,25 @@ class Marketplace:
         :type product: Product
         :param product: the product to remove from cart
         """
-        # If product is indeed in the cart
-        if product in self.carts[cart_id]:
-            self.logger.info('Removed product %s from cart %d by consumer %s',
-                             product, cart_id, current_thread().name)
+        cart = self.carts[cart_id]
+        # If product is not in the cart there is nothing to do (but it is numbered too)
+        if product not in cart:
+            with self.tracker.lock:
+                self.tracker.take_sequence()
+            return
+        stock = self.stock_of(product)
+        with stock.lock:
             # Make it available again for other consumers
-            self.products_avail.append(self.carts[cart_id].pop(self.carts[cart_id].index(product)))
+            cart.remove(product)
+            stock.add()
+            with self.tracker.lock:
+                self.tracker.progress += 1
+                self.tracker.inventory.update(product=product, stock_delta=1)
+                self.tracker.take_sequence()
+
+        self.sinks.logger.info('Removed product %s from cart %d by consumer %s',
+                               product, cart_id, current_thread().name)
+        self.sinks.count("removed_from_cart")
 
     def place_order(self, cart_id):
 
@@ -300,10 +810,174 @@ class Marketplace:
         """
 
         # Remove the requested cart with its products
-        popped = self.carts.pop(cart_id)
-        with self.register_producer_lock:
-            self.logger.info('Ordered placed for cart %d by consumer %s for product list %s',
-                             cart_id, current_thread().name, popped)
-            for item in popped:
-                print(f"{current_thread().name} bought {item}")
+        with self.register_cart_semaphore:
+            popped = self.carts.pop(cart_id)
+            self.bounds.cart_ordered.notify()
+            with self.tracker.lock:
+                self.tracker.cart_owners.pop(cart_id, None)
+                self.tracker.progress += 1
+                self.tracker.wait_for_product(cart_id, None)
+                self.tracker.inventory.update(carts_delta=-1)
+                self.tracker.take_sequence()
+        self.order_history.append_order(cart_id, current_thread().name, popped)
+        self.sinks.logger.info('Ordered placed for cart %d by consumer %s for product list %s',
+                               cart_id, current_thread().name, popped)
+        if self.sinks.output is not None:
+            # One order at a time, so the lines of different orders are not mixed up
+            with self.register_producer_lock:
+                for item in popped:
+                    self.sinks.output(f"{current_thread().name} bought {item}")
+        self.sinks.count("orders")
+        self.sinks.count("units_ordered", len(popped))
         return popped
+
+    def last_sequence(self):
+
+        """
+        Returns the number of the last operation of the calling thread (None before
+        its first one). The operations are numbered in the order they took effect,
+        so replaying them in that order gives the same results.
+        """
+
+        return getattr(self.tracker.last, "sequence", None)
+
+    def stock_of(self, product):
+
+        """
+        Returns the ProductStock of the product, created on its first use.
+
+        :type product: Product
+        :param product: the product
+        """
+
+        stock = self.stock.get(product)
+        if stock is None:
+            # Created under the tracker's lock, so products_avail can copy the dict
+            with self.tracker.lock:
+                stock = self.stock.setdefault(product, ProductStock())
+        return stock
+
+    def get_inventory(self):
+
+        """
+        Returns an immutable and consistent view of the stock per product, of the
+        fill of each producer's queue and of the number of open carts.
+        It never waits for the cart lock; the snapshot is only rebuilt after a change.
+
+        :returns an InventorySnapshot
+        """
+
+        return self.tracker.inventory.snapshot()
+
+    def get_demand(self):
+
+        """
+        Returns the number of carts waiting for each product (i.e. whose last
+        add_to_cart for that product failed).
+
+        :returns a dict (product, count)
+        """
+
+        with self.tracker.lock:
+            return dict(self.tracker.pending_demand)
+
+    def wait_for_demand(self, products):
+
+        """
+        Blocks until some of the products are wanted by more carts than there are
+        units in stock, or until the marketplace is closed.
+
+        :type products: List
+        :param products: the products of the calling producer
+
+        :returns a dict (product, missing units), most wanted first, or None after close()
+        """
+
+        tracker = self.tracker
+        wakeup = Condition(tracker.lock)
+        with tracker.lock:
+            tracker.watch(products, wakeup)
+            try:
+                while not tracker.closed:
+                    demand = {product: tracker.unmet_demand(product) for product in products}
+                    demand = {product: units for product, units
+                              in sorted(demand.items(), key=lambda item: -item[1]) if units > 0}
+                    if demand:
+                        return demand
+                    wakeup.wait()
+            finally:
+                tracker.unwatch(products, wakeup)
+        return None
+
+    def get_memory_stats(self):
+
+        """
+        Returns the number of units held by each structure and the bytes used by
+        the structures' containers (the products are shared, so only the references count).
+
+        :returns a MemoryStats
+        """
+
+        with self.register_producer_lock:
+            queues = list(self.producers_queues.values())
+        with self.register_cart_semaphore:
+            carts = list(self.carts.values())
+        with self.tracker.lock:
+            stocks = list(self.stock.values())
+            inventory = self.tracker.inventory
+            bytes_per_structure = {
+                "stock": sys.getsizeof(self.stock) +
+                         sum(sys.getsizeof(stock.suppliers) for stock in stocks),
+                "producers_queues": sys.getsizeof(self.producers_queues) +
+                                    sum(sys.getsizeof(queue) for queue in queues),
+                "carts": sys.getsizeof(self.carts) + sys.getsizeof(self.tracker.cart_owners) +
+                         sum(sys.getsizeof(cart) for cart in carts),
+                "demand": sys.getsizeof(self.tracker.waiting_carts) +
+                          sys.getsizeof(self.tracker.pending_demand),
+                "inventory": sys.getsizeof(inventory.stock) +
+                             sys.getsizeof(inventory.queue_fill),
+                "order_history": self.order_history.nbytes(),
+            }
+            return MemoryStats(
+                units_in_stock=inventory.units,
+                units_in_queues=sum(len(queue) for queue in queues),
+                units_in_carts=sum(len(cart) for cart in carts),
+                open_carts=inventory.open_carts,
+                bytes_per_structure=MappingProxyType(bytes_per_structure))
+
+    def diagnose(self):
+
+        """
+        Returns what the open carts are waiting for and which producers' queues are full.
+
+        :returns a StallReport
+        """
+
+        with self.register_producer_lock:
+            queues = list(self.producers_queues.items())
+        full_queues = {id_producer: MappingProxyType(Counter(prod_queue))
+                       for id_producer, prod_queue in queues
+                       if self.bounds.queue_full(len(prod_queue))}
+        with self.tracker.lock:
+            blocked_carts = {cart_id: (self.tracker.cart_owners.get(cart_id), product)
+                             for cart_id, product in self.tracker.waiting_carts.items()}
+            inventory = self.tracker.inventory
+            full_stock = None
+            if self.bounds.stock_full(inventory.units):
+                full_stock = MappingProxyType(dict(inventory.stock))
+            return StallReport(progress=self.tracker.progress,
+                               blocked_carts=MappingProxyType(blocked_carts),
+                               full_queues=MappingProxyType(full_queues),
+                               open_carts=inventory.open_carts, full_stock=full_stock)
+
+    def close(self):
+
+        """
+        Ends the run: the producers waiting for demand are woken up and stop.
+        The log handler is closed, later calls are not logged anymore.
+        """
+
+        with self.tracker.lock:
+            self.tracker.closed = True
+            self.tracker.notify_watchers()
+        self.sinks.close()
@@ -0,0 +1,117 @@
+"""
+This module represents the observability configuration of the Marketplace:
+where its log, its metrics and its orders go. By default they go nowhere.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass
+from logging.handlers import RotatingFileHandler
+from threading import Lock
+from typing import Callable, Optional
+
+LOG_FORMAT = '%(asctime)s %(levelname)8s: %(message)s'
+
+
+@dataclass(init=True, repr=True, order=False, frozen=True)
+class Observability:
+    """
+    The sinks of a Marketplace. The marketplace creates its own logger and handler
+    from this config and releases them on close(), so several marketplaces
+    (e.g. one per unit test) never share or accumulate handlers.
+    """
+    # The rotating log file, None for no log
+    log_file: Optional[str] = None
+    log_max_bytes: int = 25000
+    log_backup_count: int = 10
+    # Called with (event, count) for every counted event, e.g. MetricsCounter()
+    metrics: Optional[Callable] = None
+    # Called with each line of an order, e.g. print
+    output: Optional[Callable] = None
+
+    def create_logger(self):
+        """
+        Returns a new logger, outside of the logging module's hierarchy (so it is freed
+        with its owner), and its handler (None when there is no log file).
+        """
+        logger = logging.Logger("myLogger", logging.INFO)
+        if self.log_file is None:
+            # logger.info() returns right away
+            logger.disabled = True
+            return logger, None
+
+        handler = RotatingFileHandler(self.log_file, maxBytes=self.log_max_bytes,
+                                      backupCount=self.log_backup_count)
+        handler.setLevel(logging.INFO)
+        formatter = logging.Formatter(LOG_FORMAT)
+        formatter.converter = time.gmtime
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+        return logger, handler
+
+
+class Sinks:
+    """
+    The logger (and its handler), the metrics and the output created from an
+    Observability config, owned by one marketplace.
+    """
+
+    def __init__(self, observability=None):
+
+        """
+        Constructor
+
+        :type observability: Observability
+        :param observability: the config (no I/O at all by default)
+        """
+
+        observability = observability if observability is not None else Observability()
+        self.logger, self.handler = observability.create_logger()
+        self.metrics = observability.metrics
+        self.output = observability.output
+
+    def count(self, event, count=1):
+
+        """
+        Sends the event to the metrics sink, if there is one.
+        """
+
+        if self.metrics is not None:
+            self.metrics(event, count)
+
+    def close(self):
+
+        """
+        Closes the log handler, later calls are not logged anymore.
+        """
+
+        if self.handler is not None:
+            self.logger.removeHandler(self.handler)
+            self.handler.close()
+            self.logger.disabled = True
+
+
+class MetricsCounter:
+    """
+    Metrics sink that counts the events. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = Lock()
+
+    def __call__(self, event, count=1):
+        with self.lock:
+            self.counts[event] += count
+
+    def snapshot(self):
+        """
+        Returns a copy of the counts.
+        """
+        with self.lock:
+            return dict(self.counts)
@@ -0,0 +1,345 @@
+"""
+This module represents the order history: every order placed in the Marketplace,
+one line per (order, product), stored column by column in typed arrays so that
+the aggregate queries run over contiguous buffers. Full columns can be spilled
+to memory-mapped files.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import mmap
+import os
+import tempfile
+import unittest
+from array import array
+from threading import Lock
+
+from tema.product import Coffee, Tea
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Column name -> array typecode (also understood by numpy as a dtype)
+COLUMNS = {
+    "order_id": "q",
+    "consumer": "I",
+    "product": "I",
+    "quantity": "I",
+    "price": "d",
+}
+DEFAULT_SPILL_ROWS = 1 << 20
+
+
+class TestOrderHistory(unittest.TestCase):
+    """
+    Aggregates over orders kept in memory and spilled to disk.
+    """
+    def setUp(self):
+        self.tea = Tea(name="Linden", price=9, type="Herbal")
+        self.coffee = Coffee(name="Indonezia", price=1, acidity=5.05, roast_level="MEDIUM")
+
+    def fill(self, history):
+        """
+        Two consumers, three orders
+        """
+        history.append_order(0, "cons1", [self.tea, self.coffee, self.tea])
+        history.append_order(1, "cons2", [self.coffee])
+        history.append_order(2, "cons1", [self.coffee, "oua"])
+
+    def check(self, history):
+        """
+        The aggregates of the orders of fill()
+        """
+        self.assertEqual(len(history), 5, "One line per product of each order!")
+        self.assertEqual(history.orders, 3, "Three orders!")
+        self.assertEqual(history.revenue(), 21, "Wrong revenue!")
+        self.assertEqual(history.units_per_product(),
+                         {self.tea: 2, self.coffee: 3, "oua": 1}, "Wrong units!")
+        self.assertEqual(history.revenue_per_product(),
+                         {self.tea: 18, self.coffee: 3, "oua": 0}, "Wrong revenue!")
+        self.assertEqual(history.totals_per_consumer(),
+                         {"cons1": (5, 20), "cons2": (1, 1)}, "Wrong totals!")
+
+    def test_in_memory(self):
+        """
+        Orders are aggregated without spilling
+        """
+        history = OrderHistory()
+        self.fill(history)
+        self.check(history)
+        self.assertEqual(list(history.columns["quantity"]), [2, 1, 1, 1, 1], "Wrong column!")
+
+        history.append_order(3, "cons2", [Tea(name="Linden", price=9, type="Herbal")])
+        self.assertEqual(history.units_per_product()[self.tea], 3,
+                         "An equal instance is the same product!")
+
+    def test_spill(self):
+        """
+        The spilled lines and the lines still in memory are aggregated together
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            history = OrderHistory(os.path.join(directory, "orders"), spill_rows=3)
+            self.fill(history)
+            self.assertEqual(history.spilled_rows, 3, "The first two orders are spilled!")
+            self.assertEqual(len(history.columns["order_id"]), 2, "The last one is in memory!")
+            self.check(history)
+            history.close()
+
+    def test_without_numpy(self):
+        """
+        The fallback gives the same results
+        """
+        global numpy  # pylint: disable=global-statement,invalid-name
+        saved, numpy = numpy, None
+        try:
+            history = OrderHistory()
+            self.fill(history)
+            self.check(history)
+        finally:
+            numpy = saved
+
+
+class Interner:
+    """
+    The consumers and products of an OrderHistory, each with an id (its index in
+    consumers/products), and the price of each product.
+    """
+
+    def __init__(self):
+        self.consumers = []
+        self.consumer_ids = {}
+        self.products = []
+        self.product_ids = {}
+        # The price of each product id
+        self.prices = []
+        # id() of the product instances seen so far -> (instance, product id). Products are
+        # shared instances, so this spares hashing them (the instance is kept, so its id()
+        # is not reused)
+        self.instance_ids = {}
+
+    def consumer_id(self, consumer):
+        """
+        Returns the id of a consumer, assigning a new one to a consumer never seen before.
+        """
+        consumer_id = self.consumer_ids.get(consumer)
+        if consumer_id is None:
+            consumer_id = self.consumer_ids[consumer] = len(self.consumers)
+            self.consumers.append(consumer)
+        return consumer_id
+
+    def intern_product(self, product):
+        """
+        Returns the id of a product instance never seen before, assigning a new id if no
+        equal product was seen either.
+        """
+        product_id = self.product_ids.get(product)
+        if product_id is None:
+            product_id = self.product_ids[product] = len(self.products)
+            self.products.append(product)
+            self.prices.append(getattr(product, "price", 0))
+        self.instance_ids[id(product)] = (product, product_id)
+        return product_id
+
+
+class OrderHistory:
+    """
+    Columnar store of the placed orders. Consumers and products are interned:
+    the columns hold their ids. Appends and queries are serialized by a lock of
+    the history, so the marketplace's locks are never held while aggregating.
+    """
+
+    def __init__(self, spill_path=None, spill_rows=DEFAULT_SPILL_ROWS):
+
+        """
+        Constructor
+
+        :type spill_path: String
+        :param spill_path: prefix of the column files; None to keep everything in memory
+
+        :type spill_rows: Int
+        :param spill_rows: the lines kept in memory before they are spilled to the files
+        """
+
+        self.spill_path = spill_path
+        self.spill_rows = spill_rows
+        if spill_path is not None:
+            # the history starts empty, drop the files of a previous run
+            for name in COLUMNS:
+                if os.path.exists(f"{spill_path}.{name}"):
+                    os.unlink(f"{spill_path}.{name}")
+        # The lines not spilled yet, one array per column
+        self.columns = {name: array(typecode) for name, typecode in COLUMNS.items()}
+        # The spilled lines, one read only memory map per column (None while there is none)
+        self.spilled = {name: None for name in COLUMNS}
+        self.spilled_rows = 0
+        self.orders = 0
+
+        # Interned consumers and products: the columns hold their ids
+        self.interner = Interner()
+        self.lock = Lock()
+        # The appends of the columns, bound once for the hot path
+        self.appends = [self.columns[name].append for name in COLUMNS]
+
+    def __len__(self):
+        return self.spilled_rows + len(self.columns["order_id"])
+
+    def append_order(self, order_id, consumer, products):
+
+        """
+        Appends an order: one line per distinct product, with its quantity and unit price.
+
+        :type order_id: Int
+        :param order_id: the id of the ordered cart
+
+        :type consumer: String
+        :param consumer: the name of the consumer
+
+        :type products: List
+        :param products: the products returned by place_order
+        """
+
+        interner = self.interner
+        with self.lock:
+            consumer_id = interner.consumer_id(consumer)
+
+            instance_ids = interner.instance_ids
+            quantities = {}
+            for product in products:
+                instance = instance_ids.get(id(product))
+                product_id = instance[1] if instance is not None else \
+                    interner.intern_product(product)
+                quantities[product_id] = quantities.get(product_id, 0) + 1
+
+            append_order_id, append_consumer, append_product, append_quantity, append_price = \
+                self.appends
+            prices = interner.prices
+            for product_id, quantity in quantities.items():
+                append_order_id(order_id)
+                append_consumer(consumer_id)
+                append_product(product_id)
+                append_quantity(quantity)
+                append_price(prices[product_id])
+            self.orders += 1
+            if self.spill_path is not None and len(self.columns["order_id"]) >= self.spill_rows:
+                self.spill()
+
+    def spill(self):
+
+        """
+        Appends the lines kept in memory to the column files and maps the files again.
+        Called with the lock held.
+        """
+
+        for name, column in self.columns.items():
+            if self.spilled[name] is not None:
+                self.spilled[name].close()
+            with open(f"{self.spill_path}.{name}", "ab+") as column_file:
+                column.tofile(column_file)
+                column_file.flush()
+                self.spilled[name] = mmap.mmap(column_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.spilled_rows = len(self.spilled[name]) // column.itemsize
+            del column[:]
+
+    def views(self, name):
+        """
+        Returns the buffers of a column: the spilled part (if any) and the in memory part.
+        Called with the lock held.
+        """
+        views = [memoryview(self.columns[name])]
+        if self.spilled[name] is not None:
+            views.insert(0, memoryview(self.spilled[name]).cast(COLUMNS[name]))
+        return views
+
+    def column(self, name):
+        """
+        Returns the whole column as a numpy array (the in memory part is not copied
+        when nothing was spilled). Called with the lock held.
+        """
+        parts = [numpy.frombuffer(view, dtype=COLUMNS[name]) for view in self.views(name)]
+        return parts[0] if len(parts) == 1 else numpy.concatenate(parts)
+
+    def sum_by(self, key, revenue):
+        """
+        Sums the quantities (or quantity * price if revenue) grouped by the ids in the
+        key column. Called with the lock held.
+
+        :returns a list indexed by id
+        """
+        size = len(self.interner.consumers) if key == "consumer" else \
+            len(self.interner.products)
+        if numpy is not None:
+            weights = self.column("quantity")
+            if revenue:
+                weights = weights * self.column("price")
+            return numpy.bincount(self.column(key), weights=weights, minlength=size).tolist()
+
+        sums = [0] * size
+        for keys, quantities, prices in zip(self.views(key), self.views("quantity"),
+                                            self.views("price")):
+            if revenue:
+                for key_id, quantity, price in zip(keys, quantities, prices):
+                    sums[key_id] += quantity * price
+            else:
+                for key_id, quantity in zip(keys, quantities):
+                    sums[key_id] += quantity
+        return sums
+
+    def revenue(self):
+        """
+        Returns the sum of quantity * price over all the lines.
+        """
+        with self.lock:
+            if numpy is not None:
+                return float(numpy.dot(self.column("quantity").astype(numpy.float64),
+                                       self.column("price")))
+            return sum(quantity * price
+                       for quantities, prices in zip(self.views("quantity"), self.views("price"))
+                       for quantity, price in zip(quantities, prices))
+
+    def units_per_product(self):
+        """
+        Returns the units sold of each product.
+        """
+        with self.lock:
+            units = self.sum_by("product", revenue=False)
+            return {product: int(count)
+                    for product, count in zip(self.interner.products, units)}
+
+    def revenue_per_product(self):
+        """
+        Returns the revenue of each product.
+        """
+        with self.lock:
+            return dict(zip(self.interner.products, self.sum_by("product", revenue=True)))
+
+    def totals_per_consumer(self):
+        """
+        Returns (units bought, money spent) for each consumer.
+        """
+        with self.lock:
+            units = self.sum_by("consumer", revenue=False)
+            revenue = self.sum_by("consumer", revenue=True)
+            return {consumer: (int(count), spent)
+                    for consumer, count, spent in zip(self.interner.consumers, units, revenue)}
+
+    def nbytes(self):
+        """
+        Returns the bytes used by the columns kept in memory.
+        """
+        with self.lock:
+            return sum(column.buffer_info()[1] * column.itemsize
+                       for column in self.columns.values())
+
+    def close(self):
+        """
+        Unmaps the column files (they are kept on disk).
+        """
+        with self.lock:
+            for name, spilled in self.spilled.items():
+                if spilled is not None:
+                    spilled.close()
+                    self.spilled[name] = None
@@ -0,0 +1,180 @@
+"""
+This module represents the compiled cart plans of the consumers: the add and
+remove operations of the input file are turned into compact op tuples
+(opcode, product id, quantity) once, at load time, so that the Consumer does
+not look up dicts and compare strings for every unit.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import unittest
+from dataclasses import dataclass
+from enum import IntEnum
+
+
+class Opcode(IntEnum):
+    """
+    The operations of a cart.
+    """
+    ADD = 0
+    REMOVE = 1
+
+
+ADD = Opcode.ADD
+REMOVE = Opcode.REMOVE
+# The type of the operations in the input file -> opcode
+OPCODES = {"add": ADD, "remove": REMOVE}
+
+
+class TestPlanCompiler(unittest.TestCase):
+    """
+    Compiles carts.
+    """
+    def setUp(self):
+        self.compiler = PlanCompiler()
+
+    @staticmethod
+    def operation(kind, product, quantity):
+        """
+        An operation of the input file
+        """
+        return {"type": kind, "product": product, "quantity": quantity}
+
+    def test_collapse(self):
+        """
+        Adjacent operations on the same product are merged into their net quantity
+        """
+        plan = self.compiler.compile([[self.operation("add", "oua", 3),
+                                       self.operation("add", "oua", 1),
+                                       self.operation("remove", "oua", 2),
+                                       self.operation("add", "lapte", 1),
+                                       self.operation("remove", "lapte", 1),
+                                       self.operation("remove", "oua", 5),
+                                       self.operation("remove", "oua", 1),
+                                       self.operation("add", "oua", 2)]])
+        self.assertEqual(plan.products, ["oua", "lapte"], "Products are interned!")
+        # add 3, add 1, remove 2 = add 2, the lapte pair cancels out, then add 2 and
+        # remove 6 = remove 4: a remove followed by an add is kept (the remove may be a no-op)
+        self.assertEqual(plan.carts, (((Opcode.REMOVE, 0, 4), (Opcode.ADD, 0, 2)),),
+                         "Wrong net quantities!")
+        self.assertEqual(plan.operations, 2, "Two operations are left!")
+
+    def test_interning(self):
+        """
+        Equal carts and operations are shared, between consumers too
+        """
+        cart = [self.operation("add", "id1", 2), self.operation("add", "id2", 1)]
+        products = {"id1": "oua", "id2": "lapte"}
+        first = self.compiler.compile([cart, list(cart)], products)
+        second = self.compiler.compile([[dict(operation) for operation in cart]], products)
+        self.assertIs(first.carts[0], first.carts[1], "The carts are equal!")
+        self.assertIs(first.carts[0], second.carts[0], "The consumers share the cart!")
+        self.assertEqual(first.products, ["oua", "lapte"], "Products are looked up!")
+
+        with self.assertRaises(ValueError):
+            self.compiler.compile([[self.operation("buy", "oua", 1)]])
+
+
+@dataclass(init=True, repr=True, order=False, frozen=True)
+class CartPlan:
+    """
+    The compiled carts of a consumer: a tuple of carts, each a tuple of
+    (opcode, product id, quantity) operations, and the products the ids refer to.
+    """
+    carts: tuple
+    # product id -> product, shared by all the plans of a compiler
+    products: list
+
+    @property
+    def operations(self):
+        """
+        The number of operations of all the carts.
+        """
+        return sum(len(cart) for cart in self.carts)
+
+
+class PlanCompiler:
+    """
+    Compiles the carts of the consumers. Products, operations and carts are interned,
+    so the consumers of a large input file share the equal ones.
+    """
+
+    def __init__(self):
+        self.products = []
+        self.product_ids = {}
+        # (opcode, product id, quantity) -> the shared tuple
+        self.operations = {}
+        # tuple of operations -> the shared cart
+        self.carts = {}
+
+    def product_id(self, product):
+        """
+        Returns the id of a product, assigning a new one to a product never seen before.
+        """
+        product_id = self.product_ids.get(product)
+        if product_id is None:
+            product_id = self.product_ids[product] = len(self.products)
+            self.products.append(product)
+        return product_id
+
+    def compile_cart(self, cart, products):
+        """
+        Returns the operations of a cart. An operation is merged into the previous one
+        when both are on the same product and the merge keeps the cart's final content:
+          * add a, add b = add a + b and remove a, remove b = remove a + b;
+          * add a, remove b = add a - b (remove b - a when b > a: the extra units are
+            removed from the ones added before, if any);
+          * remove a, add b is kept, the remove is a no-op when the product is missing.
+        Only adjacent operations are merged, the marketplace still sees the products
+        in the order of the input file. Operations left with no units are dropped.
+        """
+        net = []
+        for operation in cart:
+            opcode = OPCODES.get(operation["type"])
+            if opcode is None:
+                raise ValueError(f"Unknown operation {operation['type']!r}")
+            product = operation["product"]
+            product_id = self.product_id(products[product] if products is not None else product)
+            quantity = operation["quantity"]
+
+            if net and net[-1][1] == product_id and net[-1][0] in (ADD, opcode):
+                previous, _, previous_quantity = net.pop()
+                if previous == opcode:
+                    quantity += previous_quantity
+                elif quantity <= previous_quantity:
+                    # add, then remove some of the added units
+                    opcode, quantity = ADD, previous_quantity - quantity
+                else:
+                    quantity -= previous_quantity
+            if quantity > 0:
+                net.append((opcode, product_id, quantity))
+
+        cart = tuple(self.operations.setdefault(operation, operation) for operation in net)
+        return self.carts.setdefault(cart, cart)
+
+    def compile(self, carts, products=None):
+
+        """
+        Compiles the carts of a consumer.
+
+        :type carts: List
+        :param carts: the carts of the input file, lists of {type, product, quantity}
+
+        :type products: Dict
+        :param products: the product of each id used in the carts; None if the carts
+        already hold the products
+
+        :returns a CartPlan
+        """
+
+        return CartPlan(carts=tuple(self.compile_cart(cart, products) for cart in carts),
+                        products=self.products)
+
+
+def compile_carts(carts, products=None):
+    """
+    Compiles the carts of a single consumer, see PlanCompiler.compile.
+    """
+    return PlanCompiler().compile(carts, products)
@@ -39,16 +39,53 @@ class Producer(Thread):
         self.producer_id = self.marketplace.register_producer()
 
     def run(self):
+        wait_for_demand = getattr(self.marketplace, "wait_for_demand", None)
+        if wait_for_demand is None:
+            # The marketplace does not report demand (e.g. a remote one)
+            self.produce_forever()
+            return
+
+        names = [product[0] for product in self.products]
+        by_name = {product[0]: product for product in self.products}
+        while True:
+            # Sleep until a consumer waits for one of our products, stop when the run ends
+            demand = wait_for_demand(names)
+            if demand is None:
+                return
+            # Most wanted products first, never more than is missing
+            for name, missing in demand.items():
+                product = by_name[name]
+                if not self.produce(product, min(missing, product[1])):
+                    return
+
+    def produce(self, product, quantity):
+        """
+        Publishes quantity units of the product.
+
+        @type product: Tuple
+        @param product: (product, quantity, production time)
+
+        @returns False if the marketplace was closed meanwhile
+        """
+        published = 0
+        while published < quantity:
+            if getattr(self.marketplace, "closed", False):
+                return False
+            # Try to add until there is an empty place in the queue
+            if self.marketplace.publish(self.producer_id, product[0]):
+                # Sleep if managed to add the product
+                time.sleep(product[2])
+                published += 1
+                continue
+            # Sleep after publishing one product
+            time.sleep(self.republish_wait_time)
+        return True
+
+    def produce_forever(self):
+        """
+        Cycles through the products regardless of the demand.
+        """
         while True:
             for product in self.products:
                 # For each product try to add in the queue as much quantity as possible
-                quantity = 0
-                while quantity < product[1]:
-                    # Try to add until there is an empty place in the queue
-                    if self.marketplace.publish(self.producer_id, product[0]):
-                        # Sleep if managed to add the product
-                        time.sleep(product[2])
-                        quantity += 1
-                        continue
-                    # Sleep after publishing one product
-                    time.sleep(self.republish_wait_time)
+                self.produce(product, product[1])
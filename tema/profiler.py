@@ -0,0 +1,314 @@
+"""
+This module represents a sampling profiler for multi-threaded runs: it samples the
+stacks of all the threads at a fixed interval, attributes the time to the
+Marketplace's methods and tells whether each thread was running, waiting for a
+lock, waiting to be notified, sleeping or waiting for the GIL.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import io
+import linecache
+import sys
+import time
+import unittest
+from collections import Counter
+from threading import Condition, Event, Lock, Thread, enumerate as all_threads, main_thread
+
+from tema.marketplace import Marketplace
+
+DEFAULT_INTERVAL = 0.005
+# The share of the CPU the sampling may take: with many threads a sample costs more,
+# so the interval is stretched to stay under it
+DEFAULT_MAX_OVERHEAD = 0.02
+OUTSIDE = "(outside)"
+CPU = "cpu"
+LOCK_WAIT = "lock-wait"
+CONDITION_WAIT = "cond-wait"
+SLEEP = "sleep"
+GIL_WAIT = "gil-wait"
+STATES = [CPU, LOCK_WAIT, CONDITION_WAIT, SLEEP, GIL_WAIT]
+MAY_BLOCK = "may-block"
+# A thread waiting to be notified is blocked in this function (Event.wait, Barrier.wait...
+# use it too). Reacquiring the condition's lock afterwards is done in _acquire_restore
+CONDITION_WAIT_CODE = Condition.wait.__code__
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    """
+    A thread sleeps, waits for the marketplace's lock, spins and waits for demand,
+    one after the other.
+    """
+    PHASE = 0.3
+
+    def work(self, marketplace):
+        """
+        The profiled thread
+        """
+        time.sleep(self.PHASE)
+        marketplace.add_to_cart(marketplace.new_cart(), "oua")
+        end = time.perf_counter() + self.PHASE
+        while time.perf_counter() < end:
+            pass
+        # nobody wants ulei, this waits until close()
+        marketplace.wait_for_demand(["ulei"])
+
+    def test_states(self):
+        """
+        Each phase is attributed to the right method and state
+        """
+        marketplace = Marketplace(3)
+        profiler = SamplingProfiler(attribute_to=Marketplace)
+        worker = Thread(target=self.work, args=(marketplace,), name="worker")
+        profiler.start()
+        with marketplace.register_cart_semaphore:
+            worker.start()
+            time.sleep(2 * self.PHASE)
+        time.sleep(2 * self.PHASE)
+        marketplace.close()
+        worker.join()
+        profiler.stop()
+
+        summary = profiler.summary()
+        self.assertGreater(summary[OUTSIDE][SLEEP], self.PHASE / 2, "The thread slept!")
+        self.assertIn("Marketplace.new_cart", summary, "The lock was held in new_cart!")
+        self.assertGreater(summary["Marketplace.new_cart"][LOCK_WAIT], self.PHASE / 2,
+                           "The thread waited for the lock!")
+        self.assertGreater(summary[OUTSIDE][CPU], self.PHASE / 2, "The thread was spinning!")
+        waiting = summary["Marketplace.wait_for_demand"]
+        self.assertGreater(waiting[CONDITION_WAIT], self.PHASE / 2,
+                           "The thread waited to be notified!")
+        self.assertLess(waiting[LOCK_WAIT], self.PHASE / 4, "The lock was free!")
+
+        output = io.StringIO()
+        profiler.write_collapsed(output)
+        self.assertIn(";Thread.run;TestSamplingProfiler.work;Marketplace.new_cart;[lock-wait] ",
+                      output.getvalue(), "Wrong collapsed stacks!")
+
+
+class StackClassifier:
+    """
+    Tells the attributed method and the state of a sampled stack. The results are
+    cached per code object and line.
+    """
+
+    def __init__(self, attribute_to=None):
+        # code object -> name of the attributed methods
+        self.methods = {}
+        if attribute_to is not None:
+            self.methods = {value.__code__: f"{attribute_to.__name__}.{name}"
+                            for name, value in vars(attribute_to).items()
+                            if hasattr(value, "__code__")}
+        # (code, line number) -> state of a thread executing that line, None if not blocking
+        self.blocking_lines = {}
+
+    def blocking_state(self, frame):
+        """
+        Returns SLEEP, LOCK_WAIT or CONDITION_WAIT if the frame's current line is a
+        blocking call (the call itself is in C, so it has no frame), MAY_BLOCK for a
+        with statement (it blocks only if its lock is taken) and None for a line that
+        does not block.
+        """
+        key = (frame.f_code, frame.f_lineno)
+        if key not in self.blocking_lines:
+            line = linecache.getline(frame.f_code.co_filename, frame.f_lineno).strip()
+            state = None
+            if "sleep(" in line:
+                state = SLEEP
+            elif frame.f_code is CONDITION_WAIT_CODE and ".acquire(" in line:
+                # the waiter lock is released by notify(), the thread is idle until then
+                state = CONDITION_WAIT
+            elif ".acquire(" in line:
+                state = LOCK_WAIT
+            elif ".wait(" in line:
+                state = CONDITION_WAIT
+            elif line.startswith("with "):
+                state = MAY_BLOCK
+            self.blocking_lines[key] = state
+        return self.blocking_lines[key]
+
+    def stack(self, frame):
+        """
+        Returns the code objects of the stack, innermost first, and the innermost
+        attributed method (OUTSIDE if there is none).
+        """
+        stack = []
+        method = OUTSIDE
+        methods = self.methods
+        while frame is not None:
+            code = frame.f_code
+            stack.append(code)
+            method = methods.get(code, method)
+            frame = frame.f_back
+        return tuple(stack), method
+
+
+class SamplingProfiler(Thread):
+    """
+    Daemon thread that samples sys._current_frames() every interval seconds (or less
+    often, when sampling all the threads would take more than max_overhead of the CPU). Each
+    sample of a thread is keyed by its stack (code objects) and its state:
+      * sleep: the thread is in a time.sleep call;
+      * lock-wait: it is blocked acquiring a lock, i.e. another thread holds it;
+      * cond-wait: it waits on a condition (or an event) to be notified, i.e. it is idle;
+      * cpu: it used CPU time since the previous sample;
+      * gil-wait: it is runnable, but did not get to run since the previous sample.
+    The summary splits the time between two samples of a thread: the CPU time it used
+    (from its CPU clock) is cpu, the rest goes to its state.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, attribute_to=None, selected=None,
+                 max_overhead=DEFAULT_MAX_OVERHEAD):
+
+        """
+        Constructor
+
+        :type interval: Float
+        :param interval: seconds between two samples
+
+        :type attribute_to: Class
+        :param attribute_to: the time is attributed to the methods of this class
+
+        :type selected: Function
+        :param selected: returns True for the threads to sample (all but the main one by default)
+
+        :type max_overhead: Float
+        :param max_overhead: the share of the CPU time the sampling may take
+        """
+
+        Thread.__init__(self, name="Profiler", daemon=True)
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.selected = selected or (lambda thread: thread is not main_thread())
+        self.classifier = StackClassifier(attribute_to)
+        self.stopped = Event()
+        self.lock = Lock()
+
+        # (thread class, stack, state) -> samples, where stack is a tuple of code objects,
+        # the innermost first
+        self.samples = Counter()
+        # (method, state) -> seconds
+        self.seconds = Counter()
+        # thread ident -> see watched()
+        self.watched_threads = {}
+        # (CPU seconds, wall seconds) of this thread, set when it stops
+        self.own_time = (0.0, 0.0)
+
+    def run(self):
+        start = time.perf_counter()
+        previous = start
+        wait = self.interval
+        cpu = time.thread_time()
+        while not self.stopped.wait(wait):
+            now = time.perf_counter()
+            with self.lock:
+                self.sample(now - previous)
+            previous = now
+            # the CPU time of this round, waiting included
+            used = time.thread_time() - cpu
+            cpu += used
+            wait = max(self.interval, used / self.max_overhead)
+        self.own_time = (time.thread_time(), time.perf_counter() - start)
+
+    def stop(self):
+        """
+        Stops sampling.
+        """
+        self.stopped.set()
+        self.join()
+
+    def watched(self, ident):
+        """
+        Returns [thread class name, CPU clock id, CPU time at the previous sample] for a
+        selected thread, None for the others. Cached per thread ident.
+        """
+        watched = self.watched_threads.get(ident, False)
+        if watched is False:
+            thread = next((thread for thread in all_threads() if thread.ident == ident), None)
+            watched = None
+            if thread is not None and thread is not self and self.selected(thread):
+                try:
+                    clock = time.pthread_getcpuclockid(ident)
+                except (AttributeError, OSError):
+                    # no per-thread CPU clocks: the threads are counted as running
+                    clock = None
+                watched = [type(thread).__name__, clock, 0.0]
+            self.watched_threads[ident] = watched
+        return watched
+
+    def sample(self, elapsed):
+        """
+        Records the state and the stack of every selected thread.
+
+        :type elapsed: Float
+        :param elapsed: seconds since the previous sample, credited to each thread
+        """
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        for ident, frame in frames.items():
+            watched = self.watched(ident)
+            if watched is None:
+                continue
+
+            state = self.classifier.blocking_state(frame)
+            # the CPU time the thread used since the previous sample
+            ran = elapsed if state is None else 0.0
+            if watched[1] is not None:
+                try:
+                    cpu = time.clock_gettime(watched[1])
+                except OSError:
+                    # the thread just ended
+                    continue
+                ran = min(cpu - watched[2], elapsed)
+                watched[2] = cpu
+            if state is MAY_BLOCK:
+                # blocked on the lock if the thread did not run since the previous sample
+                state = LOCK_WAIT if not ran else None
+            # the rest of the time it was waiting: blocked, or runnable without the GIL
+            waiting = state or GIL_WAIT
+
+            stack, method = self.classifier.stack(frame)
+            self.samples[(watched[0], stack, state or (CPU if ran else GIL_WAIT))] += 1
+            self.seconds[(method, CPU)] += ran
+            self.seconds[(method, waiting)] += elapsed - ran
+
+    def summary(self):
+        """
+        Returns method -> Counter(state -> seconds). The time of a thread outside
+        of the attributed methods is under OUTSIDE.
+        """
+        with self.lock:
+            summary = {}
+            for (method, state), seconds in self.seconds.items():
+                summary.setdefault(method, Counter())[state] += seconds
+            return summary
+
+    def write_collapsed(self, output):
+        """
+        Writes the samples as collapsed stacks (thread class;frame;...;[state] count),
+        the input of flamegraph.pl and speedscope.
+        """
+        with self.lock:
+            lines = Counter()
+            for (root, stack, state), count in self.samples.items():
+                names = [getattr(code, "co_qualname", code.co_name) for code in reversed(stack)]
+                lines[";".join([root] + names + [f"[{state}]"])] += count
+        for line, count in sorted(lines.items()):
+            output.write(f"{line} {count}\n")
+
+    def write_summary(self, output):
+        """
+        Writes the seconds per method and state, and the profiler's own overhead.
+        """
+        summary = self.summary()
+        output.write(f"{'method':<36}" + "".join(f"{state:>11}" for state in STATES) +
+                     f"{'total':>11}\n")
+        for method, states in sorted(summary.items(), key=lambda item: -sum(item[1].values())):
+            output.write(f"{method:<36}" + "".join(f"{states[state]:>10.3f}s"
+                                                   for state in STATES) +
+                         f"{sum(states.values()):>10.3f}s\n")
+        cpu_time, wall_time = self.own_time
+        if wall_time:
+            output.write(f"profiler: {cpu_time:.3f}s of CPU in {wall_time:.3f}s "
+                         f"({100 * cpu_time / wall_time:.1f}%)\n")
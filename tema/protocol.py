@@ -0,0 +1,112 @@
+"""
+This module defines the binary protocol spoken between the MarketplaceServer and
+the MarketplaceClient over a Unix domain socket.
+
+Every request is a frame made of a header (payload length, opcode) followed by
+the payload, and gets exactly one response frame (payload length, status, payload),
+in the same order. A client may send many requests before reading the responses
+(pipelining); the server answers everything it received with a single write.
+
+Products are sent only once (OP_INTERN) and referred to by a numeric id afterwards.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import json
+import struct
+from dataclasses import asdict
+
+from tema.product import Product, Tea, Coffee
+
+REQUEST_HEADER = struct.Struct("!IB")
+RESPONSE_HEADER = struct.Struct("!IB")
+ID = struct.Struct("!I")
+TWO_IDS = struct.Struct("!II")
+BOOL = struct.Struct("!?")
+
+# Opcodes
+OP_SET_NAME = 0
+OP_INTERN = 1
+OP_LOOKUP = 2
+OP_REGISTER_PRODUCER = 3
+OP_PUBLISH = 4
+OP_NEW_CART = 5
+OP_ADD_TO_CART = 6
+OP_REMOVE_FROM_CART = 7
+OP_PLACE_ORDER = 8
+
+# Response statuses
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+PRODUCT_TYPES = {product_type.__name__: product_type for product_type in (Product, Tea, Coffee)}
+
+
+def encode_frame(header, code, payload=b""):
+    """
+    Returns a request/response frame.
+
+    :type header: Struct
+    :param header: REQUEST_HEADER or RESPONSE_HEADER
+
+    :type code: Int
+    :param code: the opcode of a request or the status of a response
+    """
+    return header.pack(len(payload), code) + payload
+
+
+def decode_frames(buffer, header, limit=None):
+    """
+    Splits the complete frames at the beginning of buffer.
+
+    :type limit: Int
+    :param limit: the maximum number of frames to decode
+
+    :returns a list of (code, payload) and the number of bytes consumed
+    """
+    frames = []
+    offset = 0
+    while (limit is None or len(frames) < limit) and len(buffer) - offset >= header.size:
+        length, code = header.unpack_from(buffer, offset)
+        end = offset + header.size + length
+        if end > len(buffer):
+            break
+        frames.append((code, bytes(buffer[offset + header.size:end])))
+        offset = end
+    return frames, offset
+
+
+def encode_product(product):
+    """
+    Serializes a Product (or a plain string, as in the unit tests) for OP_INTERN.
+    """
+    if isinstance(product, Product):
+        return json.dumps([type(product).__name__, asdict(product)]).encode()
+    return json.dumps(["str", product]).encode()
+
+
+def decode_product(payload):
+    """
+    Inverse of encode_product.
+    """
+    product_type, value = json.loads(payload)
+    if product_type == "str":
+        return value
+    return PRODUCT_TYPES[product_type](**value)
+
+
+def encode_ids(ids):
+    """
+    Serializes a list of ids, used for the products of an order.
+    """
+    return ID.pack(len(ids)) + struct.pack(f"!{len(ids)}I", *ids)
+
+
+def decode_ids(payload):
+    """
+    Inverse of encode_ids.
+    """
+    count = ID.unpack_from(payload)[0]
+    return list(struct.unpack_from(f"!{count}I", payload, ID.size))
@@ -0,0 +1,275 @@
+"""
+This module represents the Marketplace server: it hosts a Marketplace behind a
+Unix domain socket, so that producers and consumers from other processes can share it.
+
+Usage: python3 -m tema.server socket_path queue_size_per_producer
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import io
+import os
+import shutil
+import socketserver
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from threading import Lock, Thread, current_thread
+
+from tema.client import MarketplaceClient
+from tema.marketplace import Marketplace
+from tema.observability import Observability
+from tema.product import Tea
+from tema.protocol import (REQUEST_HEADER, RESPONSE_HEADER, ID, TWO_IDS, BOOL,
+                           OP_SET_NAME, OP_INTERN, OP_LOOKUP, OP_REGISTER_PRODUCER, OP_PUBLISH,
+                           OP_NEW_CART, OP_ADD_TO_CART, OP_REMOVE_FROM_CART, OP_PLACE_ORDER,
+                           STATUS_OK, STATUS_ERROR, encode_frame, decode_frames,
+                           encode_product, decode_product, encode_ids)
+
+RECV_SIZE = 1 << 16
+
+
+class TestMarketplaceServer(unittest.TestCase):
+    """
+    Runs a server in a background thread and uses it through a MarketplaceClient.
+    """
+    def setUp(self):
+        """
+        Start a server with a max_queue_size_per_producer of 3
+        """
+        self.directory = tempfile.mkdtemp()
+        self.server = MarketplaceServer(os.path.join(self.directory, "market.sock"),
+                                        Marketplace(3, observability=Observability(output=print)))
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = MarketplaceClient(self.server.server_address)
+
+    def tearDown(self):
+        """
+        Stop the server and remove its socket
+        """
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_remote_calls(self):
+        """
+        The client behaves like a local marketplace
+        """
+        tea = Tea(name="Linden", price=9, type="Herbal")
+        producer = self.client.register_producer()
+        cart = self.client.new_cart()
+
+        self.assertTrue(self.client.publish(producer, tea), "Failed to publish!")
+        self.assertTrue(self.client.publish(producer, "oua"), "Failed to publish!")
+        self.assertTrue(self.client.add_to_cart(cart, tea), "Failed to add existent product!")
+        self.assertFalse(self.client.add_to_cart(cart, tea), "Cannot add same product twice!")
+        self.assertTrue(self.client.add_to_cart(cart, "oua"), "Failed to add existent product!")
+        self.client.remove_from_cart(cart, "oua")
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(self.client.place_order(cart), [tea], "Not the same!")
+        self.assertEqual(output.getvalue(), f"{current_thread().name} bought {tea}\n",
+                         "The order should be printed with the name of the caller!")
+        self.assertEqual(self.server.marketplace.products_avail, ["oua"], "Product available!")
+
+    def test_pipeline(self):
+        """
+        Pipelined requests are answered in order
+        """
+        producer = self.client.register_producer()
+        with self.client.pipeline() as pipeline:
+            for product in ["branza", "oua", "lapte", "ceai"]:
+                pipeline.publish(producer, product)
+            pipeline.new_cart()
+            pipeline.new_cart()
+        self.assertEqual(pipeline.results, [True, True, True, False, 0, 1], "Wrong results!")
+
+    def test_errors(self):
+        """
+        An exception raised by the marketplace is raised by the client too
+        """
+        with self.assertRaises(RuntimeError):
+            self.client.place_order(42)
+        self.assertEqual(self.client.new_cart(), 0, "The connection should still work!")
+
+
+class MarketplaceRequestHandler(socketserver.BaseRequestHandler):
+    """
+    Serves one client connection. The requests received in a single read are
+    executed in order and all their responses are sent back with a single write.
+    """
+
+    def setup(self):
+        """
+        Maps each opcode to the method executing it.
+        """
+        self.handlers = {
+            OP_SET_NAME: self.set_name,
+            OP_INTERN: self.intern,
+            OP_LOOKUP: self.lookup,
+            OP_REGISTER_PRODUCER: self.register_producer,
+            OP_PUBLISH: self.publish,
+            OP_NEW_CART: self.new_cart,
+            OP_ADD_TO_CART: self.add_to_cart,
+            OP_REMOVE_FROM_CART: self.remove_from_cart,
+            OP_PLACE_ORDER: self.place_order,
+        }
+
+    def handle(self):
+        """
+        Reads requests until the client closes the connection.
+        """
+        buffer = bytearray()
+        while True:
+            chunk = self.request.recv(RECV_SIZE)
+            if not chunk:
+                return
+            buffer += chunk
+            frames, consumed = decode_frames(buffer, REQUEST_HEADER)
+            del buffer[:consumed]
+            if frames:
+                self.request.sendall(b"".join(self.execute(opcode, payload)
+                                              for opcode, payload in frames))
+
+    def execute(self, opcode, payload):
+        """
+        Executes one request and returns its response frame.
+        """
+        try:
+            return encode_frame(RESPONSE_HEADER, STATUS_OK, self.handlers[opcode](payload))
+        except Exception as error:  # pylint: disable=broad-except
+            return encode_frame(RESPONSE_HEADER, STATUS_ERROR, repr(error).encode())
+
+    @staticmethod
+    def set_name(payload):
+        """
+        The following requests are executed on behalf of the client's thread,
+        so the marketplace logs and prints its name.
+        """
+        current_thread().name = payload.decode()
+        return b""
+
+    def intern(self, payload):
+        """
+        Returns the id of the received product.
+        """
+        return ID.pack(self.server.intern(decode_product(payload)))
+
+    def lookup(self, payload):
+        """
+        Returns the product with the received id.
+        """
+        return encode_product(self.server.products[ID.unpack(payload)[0]])
+
+    def register_producer(self, _):
+        """
+        See Marketplace.register_producer.
+        """
+        return ID.pack(self.server.marketplace.register_producer())
+
+    def publish(self, payload):
+        """
+        See Marketplace.publish.
+        """
+        producer_id, product_id = TWO_IDS.unpack(payload)
+        return BOOL.pack(self.server.marketplace.publish(producer_id,
+                                                         self.server.products[product_id]))
+
+    def new_cart(self, _):
+        """
+        See Marketplace.new_cart.
+        """
+        return ID.pack(self.server.marketplace.new_cart())
+
+    def add_to_cart(self, payload):
+        """
+        See Marketplace.add_to_cart.
+        """
+        cart_id, product_id = TWO_IDS.unpack(payload)
+        return BOOL.pack(self.server.marketplace.add_to_cart(cart_id,
+                                                             self.server.products[product_id]))
+
+    def remove_from_cart(self, payload):
+        """
+        See Marketplace.remove_from_cart.
+        """
+        cart_id, product_id = TWO_IDS.unpack(payload)
+        self.server.marketplace.remove_from_cart(cart_id, self.server.products[product_id])
+        return b""
+
+    def place_order(self, payload):
+        """
+        See Marketplace.place_order.
+        """
+        products = self.server.marketplace.place_order(ID.unpack(payload)[0])
+        return encode_ids([self.server.product_ids[product] for product in products])
+
+
+class MarketplaceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Hosts a Marketplace behind a Unix domain socket, one thread per connection.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, marketplace):
+
+        """
+        Constructor
+
+        :type socket_path: String
+        :param socket_path: the path of the Unix domain socket (replaced if it exists)
+
+        :type marketplace: Marketplace
+        :param marketplace: the hosted marketplace
+        """
+
+        # Products received so far: id -> product and product -> id
+        self.products = []
+        self.product_ids = {}
+        self.products_lock = Lock()
+        self.marketplace = marketplace
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, MarketplaceRequestHandler)
+
+    def intern(self, product):
+
+        """
+        Returns the id of the product, assigning a new one if it was never seen.
+        """
+
+        with self.products_lock:
+            if product not in self.product_ids:
+                self.product_ids[product] = len(self.products)
+                self.products.append(product)
+            return self.product_ids[product]
+
+
+def main():
+    """
+    Serves a new Marketplace on the socket given on the command line until interrupted.
+    """
+    if len(sys.argv) != 3:
+        print("Usage: python3 -m tema.server socket_path queue_size_per_producer")
+        return
+
+    observability = Observability(log_file="marketplace.log", output=print)
+    marketplace = Marketplace(int(sys.argv[2]), observability=observability)
+    with MarketplaceServer(sys.argv[1], marketplace) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(sys.argv[1])
+            marketplace.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,785 @@
+"""
+This module records every call made to a Marketplace into a compact binary trace
+and replays a trace against any Marketplace implementation, either single
+threaded or following the original interleaving of the threads.
+
+Usage: python3 -m tema.trace trace_file [--interleaved] [--implementation module:Class ...]
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import argparse
+import heapq
+import importlib
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import unittest
+from collections import namedtuple
+from contextlib import redirect_stdout
+from dataclasses import dataclass, field
+from queue import Queue, Empty
+from threading import Lock, Thread, current_thread, local
+
+from tema.admission import AdmissionControl, Busy
+from tema.marketplace import Marketplace
+from tema.protocol import (OP_REGISTER_PRODUCER, OP_PUBLISH, OP_NEW_CART, OP_ADD_TO_CART,
+                           OP_REMOVE_FROM_CART, OP_PLACE_ORDER, encode_product, decode_product)
+
+MAGIC = b"MKTR"
+# magic, format version, queue_size_per_producer of the traced marketplace, sequence
+# number of the first traced call
+HEADER = struct.Struct("<4sHIQ")
+VERSION = 3
+# kind, start (ns since the recorder was created), duration (ns), thread, opcode,
+# first argument (producer/cart id), product, result, sequence number (the order the
+# call took effect in)
+CALL = struct.Struct("<BQQIBIIiQ")
+# kind, id, length of the encoded name/product that follows
+DEFINITION = struct.Struct("<BIH")
+MAX_DEFINITION_LENGTH = (1 << 16) - 1
+KIND_CALL = 0
+KIND_THREAD = 1
+KIND_PRODUCT = 2
+# Result of an add_to_cart turned away by an AdmissionControl (0 and 1 are False and True)
+RESULT_BUSY = 2
+# Sequence number of a call that never reached the marketplace (or was recorded directly)
+NO_SEQUENCE = (1 << 64) - 1
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+DEFAULT_BUFFERS = 4
+
+METHOD_NAMES = {
+    OP_REGISTER_PRODUCER: "register_producer",
+    OP_PUBLISH: "publish",
+    OP_NEW_CART: "new_cart",
+    OP_ADD_TO_CART: "add_to_cart",
+    OP_REMOVE_FROM_CART: "remove_from_cart",
+    OP_PLACE_ORDER: "place_order",
+}
+
+Call = namedtuple("Call", "start duration thread opcode argument product result sequence")
+
+
+class TestTrace(unittest.TestCase):
+    """
+    Records a small workload and replays it.
+    """
+    def setUp(self):
+        """
+        Record a trace of two producers and one consumer, with tiny buffers
+        so that the background flushing is exercised too
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "trace.bin")
+        marketplace = Marketplace(3)
+        self.traced = TracingMarketplace(marketplace, self.path, buffer_size=64)
+
+        producers = [self.traced.register_producer(), self.traced.register_producer()]
+        cart = self.traced.new_cart()
+        for product in ["oua", "lapte", "ulei", "ceai"]:
+            self.traced.publish(producers[0], product)
+        self.traced.publish(producers[1], "oua")
+        self.traced.add_to_cart(cart, "oua")
+        self.traced.add_to_cart(cart, "oua")
+        self.traced.add_to_cart(cart, "branza")
+        self.traced.remove_from_cart(cart, "oua")
+        self.traced.place_order(cart)
+        self.traced.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_load_trace(self):
+        """
+        Every call is in the trace, in order, with its result
+        """
+        queue_size, calls = load_trace(self.path)
+        calls = list(calls)
+        self.assertEqual(queue_size, 3, "Wrong queue size!")
+        self.assertEqual([METHOD_NAMES[call.opcode] for call in calls],
+                         ["register_producer"] * 2 + ["new_cart"] + ["publish"] * 5 +
+                         ["add_to_cart"] * 3 + ["remove_from_cart", "place_order"],
+                         "Wrong calls!")
+        self.assertEqual([call.result for call in calls if call.opcode == OP_PUBLISH],
+                         [True, True, True, False, True], "Wrong results!")
+        self.assertEqual(calls[-1].result, ["oua"], "Wrong order!")
+        self.assertEqual({call.thread for call in calls}, {current_thread().name}, "Wrong thread!")
+
+    def test_replay(self):
+        """
+        Replaying the trace on a new marketplace gives the same results
+        """
+        for interleaved in (False, True):
+            report = replay(self.path, Marketplace(3), interleaved)
+            self.assertEqual(report.calls, 13, "Not all calls were replayed!")
+            self.assertEqual(report.mismatches, 0, "Different results!")
+
+    def test_record_limits(self):
+        """
+        Long calls and many threads fit in a record, the calls that do not are dropped
+        """
+        path = os.path.join(self.directory, "limits.bin")
+        recorder = TraceRecorder(path)
+        # a call that lasted 5 s, longer than a 32 bit count of nanoseconds
+        recorder.start -= 5 * 10 ** 9
+        recorder.record(recorder.start, OP_NEW_CART, result=0)
+        # a thread beyond the range of a 16 bit thread id
+        recorder.thread_count = 1 << 16
+        thread = Thread(target=recorder.record, args=(time.perf_counter_ns(), OP_NEW_CART),
+                        kwargs={"result": 1})
+        thread.start()
+        thread.join()
+        recorder.record(time.perf_counter_ns(), OP_ADD_TO_CART, -1, "oua", 0)
+        recorder.record(time.perf_counter_ns(), OP_ADD_TO_CART, 0, object(), 0)
+        recorder.close()
+
+        self.assertEqual(recorder.dropped, 2, "The invalid calls should be dropped!")
+        _, calls = load_trace(path)
+        calls = list(calls)
+        self.assertEqual(len(calls), 2, "The valid calls should be recorded!")
+        self.assertGreaterEqual(calls[0].duration, 5 * 10 ** 9, "Wrong duration!")
+        self.assertNotEqual(calls[0].thread, calls[1].thread, "Wrong thread!")
+
+    def test_sequence_order(self):
+        """
+        The calls are loaded in the order they took effect, not in the order they returned
+        """
+        path = os.path.join(self.directory, "sequence.bin")
+        recorder = TraceRecorder(path, 3, first_sequence=5)
+        recorder.record(time.perf_counter_ns(), OP_NEW_CART, result=1, sequence=6)
+        recorder.record(time.perf_counter_ns(), OP_NEW_CART, result=0, sequence=5)
+        recorder.record(time.perf_counter_ns(), OP_NEW_CART, result=2, sequence=7)
+        recorder.close()
+
+        _, calls = load_trace(path)
+        self.assertEqual([call.result for call in calls], [0, 1, 2], "Wrong order!")
+
+    def test_concurrent_calls(self):
+        """
+        Calls made by several threads at once are replayed with the same results
+        """
+        path = os.path.join(self.directory, "concurrent.bin")
+        traced = TracingMarketplace(Marketplace(2), path)
+
+        def produce(producer):
+            for i in range(1000):
+                traced.publish(producer, ["oua", "lapte"][i % 2])
+
+        def consume():
+            for _ in range(100):
+                cart = traced.new_cart()
+                for product in ["oua", "lapte", "oua"]:
+                    traced.add_to_cart(cart, product)
+                traced.remove_from_cart(cart, "lapte")
+                traced.place_order(cart)
+
+        threads = [Thread(target=produce, args=(traced.register_producer(),)) for _ in range(4)]
+        threads += [Thread(target=consume) for _ in range(4)]
+        # switch threads often, so that calls overlap
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        traced.close()
+
+        for interleaved in (False, True):
+            self.assertEqual(replay(path, Marketplace(2), interleaved).mismatches, 0,
+                             "The calls should be recorded in the order they took effect!")
+
+    def test_busy(self):
+        """
+        The calls shed by an admission control are recorded as busy and not replayed
+        """
+        path = os.path.join(self.directory, "busy.bin")
+        traced = TracingMarketplace(AdmissionControl(Marketplace(3), rate=1, burst=1), path)
+        cart = traced.new_cart()
+        self.assertIs(traced.add_to_cart(cart, "oua"), False, "Out of stock!")
+        self.assertIs(traced.add_to_cart(cart, "oua"), False, "The retry takes the token!")
+        self.assertIsInstance(traced.add_to_cart(cart, "oua"), Busy, "No tokens left!")
+        traced.close()
+
+        _, calls = load_trace(path)
+        calls = list(calls)
+        self.assertIs(calls[2].result, False, "Out of stock!")
+        self.assertIsInstance(calls[3].result, Busy, "The call was shed!")
+        report = replay(path, Marketplace(3))
+        self.assertEqual((report.calls, report.shed, report.mismatches), (3, 1, 0),
+                         "The shed call should not be replayed!")
+
+
+class Buffers:
+    """
+    The preallocated buffers of a TraceRecorder: the one being filled, the full ones
+    waiting for the background thread and the free ones it gave back.
+    """
+
+    def __init__(self, buffer_size, buffers):
+        self.buffer_size = buffer_size
+        self.free = Queue()
+        for _ in range(buffers - 1):
+            self.free.put(bytearray(buffer_size))
+        self.full = Queue()
+        self.buffer = bytearray(buffer_size)
+        self.offset = 0
+
+    def reserve(self, size):
+
+        """
+        Returns the offset in self.buffer where size bytes can be written. When the
+        buffer has no room left, it is handed to the background thread first.
+        """
+
+        if self.offset + size > self.buffer_size:
+            self.full.put((self.buffer, self.offset))
+            try:
+                self.buffer = self.free.get_nowait()
+            except Empty:
+                self.buffer = bytearray(self.buffer_size)
+            self.offset = 0
+        offset = self.offset
+        self.offset += size
+        return offset
+
+
+class TraceRecorder:
+    """
+    Appends fixed size call records to preallocated buffers. A full buffer is
+    handed to a background thread that writes it to the trace file and gives it
+    back, so recording a call never waits for the disk.
+    """
+
+    def __init__(self, path, queue_size_per_producer=0, first_sequence=0,
+                 buffer_size=DEFAULT_BUFFER_SIZE, buffers=DEFAULT_BUFFERS):
+
+        """
+        Constructor
+
+        :type path: String
+        :param path: the trace file (overwritten)
+
+        :type queue_size_per_producer: Int
+        :param queue_size_per_producer: stored in the header, used when replaying
+
+        :type first_sequence: Int
+        :param first_sequence: the sequence number of the first call, stored in the header
+
+        :type buffer_size: Int
+        :param buffer_size: the size in bytes of each buffer
+
+        :type buffers: Int
+        :param buffers: the number of buffers allocated upfront
+        """
+
+        self.start = time.perf_counter_ns()
+        self.file = open(path, "wb")  # pylint: disable=consider-using-with
+        self.file.write(HEADER.pack(MAGIC, VERSION, queue_size_per_producer, first_sequence))
+
+        self.buffers = Buffers(buffer_size, buffers)
+        self.buffer_lock = Lock()
+        self.closed = False
+        # Calls that could not be recorded (see record())
+        self.dropped = 0
+
+        # Ids of the threads and products seen so far
+        self.threads = local()
+        self.thread_count = 0
+        self.product_ids = {}
+
+        self.flusher = Thread(target=self.flush_buffers, name="trace-flusher", daemon=True)
+        self.flusher.start()
+
+    def define(self, kind, definition_id, encoded):
+
+        """
+        Writes a thread name or product definition. Called with buffer_lock held.
+        """
+
+        buffers = self.buffers
+        offset = buffers.reserve(DEFINITION.size + len(encoded))
+        DEFINITION.pack_into(buffers.buffer, offset, kind, definition_id, len(encoded))
+        buffers.buffer[offset + DEFINITION.size:offset + DEFINITION.size + len(encoded)] = encoded
+
+    def product_id(self, product):
+
+        """
+        Returns the id of the product (0 for None), defining it the first time.
+        Called with buffer_lock held.
+        """
+
+        if product is None:
+            return 0
+        product_id = self.product_ids.get(product)
+        if product_id is None:
+            encoded = encode_product(product)
+            if len(encoded) > MAX_DEFINITION_LENGTH:
+                raise ValueError("The product is too large to be traced")
+            product_id = self.product_ids[product] = len(self.product_ids)
+            self.define(KIND_PRODUCT, product_id, encoded)
+        return product_id
+
+    def record(self, start, opcode, argument=0, product=None, result=-1, *,
+               sequence=NO_SEQUENCE):
+
+        """
+        Records a call that started at start (time.perf_counter_ns()) and just returned,
+        the sequence-th call to take effect.
+        It never raises, so tracing cannot break the traced marketplace: a call that
+        does not fit in a record (an id or a result out of its field's range, a product
+        that cannot be encoded) is counted in dropped instead.
+        """
+
+        end = time.perf_counter_ns()
+        thread_id = getattr(self.threads, "id", None)
+        with self.buffer_lock:
+            if self.closed:
+                return
+            try:
+                if thread_id is None:
+                    thread_id = self.threads.id = self.thread_count
+                    self.thread_count += 1
+                    self.define(KIND_THREAD, thread_id,
+                                current_thread().name.encode()[:MAX_DEFINITION_LENGTH])
+                product_id = self.product_id(product)
+                offset = self.buffers.reserve(CALL.size)
+                try:
+                    CALL.pack_into(self.buffers.buffer, offset, KIND_CALL, start - self.start,
+                                   end - start, thread_id, opcode, argument, product_id, result,
+                                   sequence)
+                except struct.error:
+                    # the record is not written, give its slot back
+                    self.buffers.offset = offset
+                    raise
+            except (struct.error, TypeError, ValueError):
+                self.dropped += 1
+
+    def flush_buffers(self):
+
+        """
+        Body of the background thread: writes the full buffers, in order.
+        """
+
+        while True:
+            buffer, length = self.buffers.full.get()
+            if buffer is None:
+                return
+            self.file.write(memoryview(buffer)[:length])
+            self.buffers.free.put(buffer)
+
+    def close(self):
+
+        """
+        Writes the remaining records and closes the trace file. The calls made
+        after this are not recorded.
+        """
+
+        with self.buffer_lock:
+            self.closed = True
+            self.buffers.full.put((self.buffers.buffer, self.buffers.offset))
+            self.buffers.full.put((None, 0))
+        self.flusher.join()
+        self.file.close()
+
+
+class TracingMarketplace:
+    """
+    Wraps a marketplace (a Marketplace, a MarketplaceClient, ...) and records
+    every call made through it. The other attributes are the wrapped ones.
+    Each call is recorded with the sequence number the marketplace gave it where
+    its result was decided (last_sequence), so the calls can be replayed in the
+    order they took effect even if they overlapped. A marketplace that does not
+    number its operations (e.g. a remote one) gets numbers in the order the calls
+    returned instead.
+    """
+
+    def __init__(self, marketplace, path, **kwargs):
+
+        """
+        Constructor
+
+        :type marketplace: Marketplace
+        :param marketplace: the traced marketplace
+
+        :type path: String
+        :param path: the trace file
+
+        :type kwargs:
+        :param kwargs: other arguments that are passed to the TraceRecorder's __init__()
+        """
+
+        self.marketplace = marketplace
+        # Numbers of the calls when the marketplace has no last_sequence
+        self.returned = 0
+        self.returned_lock = Lock()
+        self.recorder = TraceRecorder(path, getattr(marketplace, "queue_size_per_producer", 0),
+                                      getattr(marketplace, "sequence", 0), **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.marketplace, name)
+
+    def sequence(self, result=None):
+
+        """
+        Returns the sequence number of the call the calling thread just made.
+        """
+
+        if isinstance(result, Busy):
+            return NO_SEQUENCE
+        last_sequence = getattr(self.marketplace, "last_sequence", None)
+        if last_sequence is not None:
+            return last_sequence()
+        with self.returned_lock:
+            self.returned += 1
+            return self.returned - 1
+
+    def register_producer(self):
+        """
+        See Marketplace.register_producer.
+        """
+        start = time.perf_counter_ns()
+        result = self.marketplace.register_producer()
+        self.recorder.record(start, OP_REGISTER_PRODUCER, result=result,
+                             sequence=self.sequence())
+        return result
+
+    def publish(self, producer_id, product):
+        """
+        See Marketplace.publish.
+        """
+        start = time.perf_counter_ns()
+        result = self.marketplace.publish(producer_id, product)
+        self.recorder.record(start, OP_PUBLISH, int(producer_id), product, int(bool(result)),
+                             sequence=self.sequence())
+        return result
+
+    def new_cart(self):
+        """
+        See Marketplace.new_cart.
+        """
+        start = time.perf_counter_ns()
+        result = self.marketplace.new_cart()
+        self.recorder.record(start, OP_NEW_CART, result=result, sequence=self.sequence())
+        return result
+
+    def add_to_cart(self, cart_id, product):
+        """
+        See Marketplace.add_to_cart.
+        """
+        start = time.perf_counter_ns()
+        result = self.marketplace.add_to_cart(cart_id, product)
+        self.recorder.record(start, OP_ADD_TO_CART, cart_id, product,
+                             RESULT_BUSY if isinstance(result, Busy) else int(bool(result)),
+                             sequence=self.sequence(result))
+        return result
+
+    def remove_from_cart(self, cart_id, product):
+        """
+        See Marketplace.remove_from_cart.
+        """
+        start = time.perf_counter_ns()
+        result = self.marketplace.remove_from_cart(cart_id, product)
+        self.recorder.record(start, OP_REMOVE_FROM_CART, cart_id, product,
+                             sequence=self.sequence())
+        return result
+
+    def place_order(self, cart_id):
+        """
+        See Marketplace.place_order. The ordered products are recorded as a
+        sequence of OP_PLACE_ORDER records with result -1 except the last one,
+        which holds the number of products.
+        """
+        start = time.perf_counter_ns()
+        result = self.marketplace.place_order(cart_id)
+        sequence = self.sequence()
+        for product in result:
+            self.recorder.record(start, OP_PLACE_ORDER, cart_id, product, sequence=sequence)
+        self.recorder.record(start, OP_PLACE_ORDER, cart_id, result=len(result),
+                             sequence=sequence)
+        return result
+
+    def close(self):
+        """
+        Flushes and closes the trace, then closes the traced marketplace.
+        """
+        self.recorder.close()
+        close = getattr(self.marketplace, "close", None)
+        if close is not None:
+            close()
+
+
+def read_definition(trace_file, threads, products):
+
+    """
+    Reads the thread name or product definition at the current position of the
+    trace file into threads or products (id -> name/product).
+    """
+
+    kind, definition_id, length = DEFINITION.unpack(trace_file.read(DEFINITION.size))
+    encoded = trace_file.read(length)
+    if kind == KIND_THREAD:
+        threads[definition_id] = encoded.decode()
+    else:
+        products[definition_id] = decode_product(encoded)
+
+
+def read_header(trace_file):
+
+    """
+    Reads the header of a trace file opened in binary mode.
+
+    :returns the queue_size_per_producer of the traced marketplace and the sequence
+    number of the first call
+    """
+
+    header = trace_file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError(f"{trace_file.name} is not a marketplace trace")
+    magic, version, queue_size, first_sequence = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{trace_file.name} is not a marketplace trace")
+    return queue_size, first_sequence
+
+
+def read_calls(trace_file, first_sequence):
+
+    """
+    Reads the calls that follow the header, lazily, in the order they took effect.
+    The records are written when the calls return, so a call is held back only until
+    the calls numbered before it (still running when it returned) are read. Calls
+    made on the marketplace without the tracer leave gaps in the numbers: the calls
+    after a gap are held back until the end of the file.
+    """
+
+    threads = {}
+    products = {}
+    # thread id -> the products of the place_order being read
+    ordered = {}
+    # (sequence, Call) read before their turn
+    pending = []
+    expected = first_sequence
+    with trace_file:
+        while True:
+            kind = trace_file.peek(1)[:1]
+            if not kind:
+                break
+            if kind[0] != KIND_CALL:
+                read_definition(trace_file, threads, products)
+                continue
+            record = trace_file.read(CALL.size)
+            if len(record) < CALL.size:
+                # the end of a trace whose recording was interrupted
+                break
+
+            _, start, duration, thread_id, opcode, argument, product_id, result, sequence = \
+                CALL.unpack(record)
+            product = products.get(product_id) if opcode not in (OP_REGISTER_PRODUCER,
+                                                                 OP_NEW_CART) else None
+            if opcode == OP_PLACE_ORDER:
+                if result < 0:
+                    ordered.setdefault(thread_id, []).append(product)
+                    continue
+                result, product = ordered.pop(thread_id, []), None
+            elif opcode == OP_ADD_TO_CART and result == RESULT_BUSY:
+                result = Busy(0.0)
+            elif opcode in (OP_PUBLISH, OP_ADD_TO_CART):
+                result = bool(result)
+            elif opcode == OP_REMOVE_FROM_CART:
+                result = None
+            call = Call(start, duration, threads[thread_id], opcode, argument, product, result,
+                        sequence)
+
+            if sequence == NO_SEQUENCE:
+                yield call
+                continue
+            heapq.heappush(pending, (sequence, call))
+            while pending and pending[0][0] == expected:
+                yield heapq.heappop(pending)[1]
+                expected += 1
+        while pending:
+            yield heapq.heappop(pending)[1]
+
+
+def load_trace(path):
+
+    """
+    Opens a trace file.
+
+    :returns the queue_size_per_producer of the traced marketplace and an iterator over
+    the Calls, read as they are consumed (thread names and products instead of their ids;
+    the result of place_order is the list of ordered products, the result of
+    publish/add_to_cart a bool, or a Busy for an add_to_cart shed by an AdmissionControl,
+    whose retry_after is not recorded)
+    """
+
+    trace_file = open(path, "rb")  # pylint: disable=consider-using-with
+    try:
+        queue_size, first_sequence = read_header(trace_file)
+    except ValueError:
+        trace_file.close()
+        raise
+    return queue_size, read_calls(trace_file, first_sequence)
+
+
+@dataclass
+class ReplayReport:
+    """
+    Outcome of a replay.
+    """
+    calls: int = 0
+    # calls whose result differs from the recorded one
+    mismatches: int = 0
+    # calls shed by an admission control when recorded: they never reached the
+    # marketplace, so they are not replayed
+    shed: int = 0
+    elapsed: float = 0.0
+    # method name -> total seconds spent in it
+    time_per_method: dict = field(default_factory=dict)
+
+
+class Replayer:
+    """
+    Executes recorded calls on a marketplace. The producer and cart ids returned
+    by the marketplace are mapped to the recorded ones, so an implementation
+    that numbers them differently can be replayed too.
+    """
+
+    def __init__(self, marketplace):
+        self.marketplace = marketplace
+        self.producer_ids = {}
+        self.cart_ids = {}
+        self.report = ReplayReport()
+        self.report_lock = Lock()
+
+    def execute(self, call):
+
+        """
+        Executes one call and updates the report.
+        """
+
+        if isinstance(call.result, Busy):
+            with self.report_lock:
+                self.report.shed += 1
+            return
+        method = METHOD_NAMES[call.opcode]
+        start = time.perf_counter()
+        if call.opcode == OP_REGISTER_PRODUCER:
+            result = self.producer_ids[call.result] = self.marketplace.register_producer()
+        elif call.opcode == OP_NEW_CART:
+            result = self.cart_ids[call.result] = self.marketplace.new_cart()
+        elif call.opcode == OP_PUBLISH:
+            result = self.marketplace.publish(self.producer_ids[call.argument], call.product)
+        else:
+            result = getattr(self.marketplace, method)(self.cart_ids[call.argument],
+                                                       *([call.product] if call.product is not
+                                                         None else []))
+        elapsed = time.perf_counter() - start
+
+        if call.opcode in (OP_REGISTER_PRODUCER, OP_NEW_CART):
+            # the recorded id was mapped to the new one, they match by construction
+            result = call.result
+        with self.report_lock:
+            self.report.calls += 1
+            self.report.mismatches += result != call.result
+            self.report.time_per_method[method] = \
+                self.report.time_per_method.get(method, 0.0) + elapsed
+
+
+def replay(path, marketplace, interleaved=False):
+
+    """
+    Replays a trace on the given marketplace.
+
+    :type interleaved: Bool
+    :param interleaved: if False, all the calls are executed in order by the calling
+    thread (renamed after the recorded thread before each call). If True, every
+    recorded thread gets its own thread and the calls are handed to them one at a
+    time, so they happen in exactly the recorded order.
+
+    :returns a ReplayReport
+    """
+
+    _, calls = load_trace(path)
+    replayer = Replayer(marketplace)
+    start = time.perf_counter()
+
+    if not interleaved:
+        thread = current_thread()
+        name = thread.name
+        for call in calls:
+            thread.name = call.thread
+            replayer.execute(call)
+        thread.name = name
+    else:
+        done = Queue()
+
+        def run(queue):
+            while True:
+                call = queue.get()
+                if call is None:
+                    return
+                try:
+                    replayer.execute(call)
+                finally:
+                    done.put(None)
+
+        # recorded thread name -> (its queue of calls, its thread)
+        workers = {}
+        for call in calls:
+            if call.thread not in workers:
+                queue = Queue()
+                workers[call.thread] = (queue, Thread(target=run, args=(queue,),
+                                                      name=call.thread))
+                workers[call.thread][1].start()
+            # one call at a time, in the recorded order
+            workers[call.thread][0].put(call)
+            done.get()
+        for queue, thread in workers.values():
+            queue.put(None)
+            thread.join()
+
+    replayer.report.elapsed = time.perf_counter() - start
+    return replayer.report
+
+
+def main():
+    """
+    Replays the trace given on the command line on each implementation and prints
+    the mismatches and the time spent per method.
+    """
+    parser = argparse.ArgumentParser(description="Replays a marketplace trace")
+    parser.add_argument("trace_file")
+    parser.add_argument("--interleaved", action="store_true",
+                        help="replay with the original interleaving of the threads")
+    parser.add_argument("--implementation", action="append",
+                        help="module:Class of a Marketplace implementation (repeatable)")
+    arguments = parser.parse_args()
+
+    with open(arguments.trace_file, "rb") as trace_file:
+        queue_size, _ = read_header(trace_file)
+    print(f"{'implementation':<40}{'calls':>10}{'mismatches':>12}{'seconds':>10}")
+    for implementation in arguments.implementation or ["tema.marketplace:Marketplace"]:
+        module, name = implementation.split(":")
+        marketplace = getattr(importlib.import_module(module), name)(queue_size)
+        # the replayed orders are not interesting, only the time spent to place them
+        with open(os.devnull, "w", encoding="utf-8") as devnull, redirect_stdout(devnull):
+            report = replay(arguments.trace_file, marketplace, arguments.interleaved)
+        print(f"{implementation:<40}{report.calls:>10}{report.mismatches:>12}"
+              f"{report.elapsed:>10.3f}")
+        if report.shed:
+            print(f"    {report.shed} calls shed by the admission control were not replayed")
+        for method, seconds in sorted(report.time_per_method.items()):
+            print(f"    {method:<36}{seconds:>32.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+This module represents the Watchdog: it watches the Marketplace's progress and
+reports what the carts wait for when none of them moves for too long.
+
+Computer Systems Architecture Course
+Assignment 1
+March 2021
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from functools import partial
+from threading import Event, Thread
+
+from tema.marketplace import Marketplace
+from tema.trace import TracingMarketplace, load_trace
+
+# Exit status of test.py when the watchdog aborts the run
+EXIT_STALLED = 3
+
+# Seconds abort waits for the marketplace to close before exiting anyway
+CLOSE_TIMEOUT = 5
+
+
+class TestWatchdog(unittest.TestCase):
+    """
+    A consumer waits for a product that its producer cannot publish anymore.
+    """
+    def test_stall(self):
+        """
+        The queue of the only producer is full of a product nobody wants
+        """
+        marketplace = Marketplace(2)
+        producer = marketplace.register_producer()
+        marketplace.publish(producer, "ulei")
+        marketplace.publish(producer, "ulei")
+        cart = marketplace.new_cart()
+        marketplace.add_to_cart(cart, "oua")
+
+        reports = []
+        watchdog = Watchdog(marketplace, 0.2, on_stall=reports.append, interval=0.02)
+        watchdog.start()
+        watchdog.join(2)
+        self.assertFalse(watchdog.is_alive(), "The stall was not detected!")
+        self.assertEqual(dict(reports[0].blocked_carts), {cart: ("MainThread", "oua")},
+                         "Wrong blocked carts!")
+        self.assertEqual({producer_id: dict(products) for producer_id, products
+                          in reports[0].full_queues.items()}, {producer: {"ulei": 2}},
+                         "Wrong full queues!")
+
+    def test_progress(self):
+        """
+        Carts that keep moving (or no cart at all) are not a stall
+        """
+        marketplace = Marketplace(2)
+        producer = marketplace.register_producer()
+        reports = []
+        watchdog = Watchdog(marketplace, 0.2, on_stall=reports.append, interval=0.02)
+        watchdog.start()
+        time.sleep(0.3)
+        for _ in range(5):
+            cart = marketplace.new_cart()
+            marketplace.publish(producer, "oua")
+            marketplace.add_to_cart(cart, "oua")
+            marketplace.place_order(cart)
+            time.sleep(0.1)
+        watchdog.stop()
+        self.assertEqual(reports, [], "Not a stall!")
+
+    def test_abort(self):
+        """
+        Aborting closes the marketplace first, so the trace of the stalled run is complete
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "stall.bin")
+            traced = TracingMarketplace(Marketplace(2), path, buffer_size=64)
+            producer = traced.register_producer()
+            traced.publish(producer, "ulei")
+            cart = traced.new_cart()
+            traced.add_to_cart(cart, "oua")
+
+            exits = []
+            abort(traced.diagnose(), traced, exit_process=exits.append)
+            self.assertEqual(exits, [EXIT_STALLED], "Wrong exit status!")
+            self.assertTrue(traced.closed, "The marketplace was not closed!")
+            _, calls = load_trace(path)
+            self.assertEqual(len(list(calls)), 4, "The trace was truncated!")
+        finally:
+            shutil.rmtree(directory)
+
+
+def abort(report, marketplace=None, exit_process=os._exit):  # pylint: disable=protected-access
+    """
+    Default action: prints the diagnostic and ends the process right away
+    (the consumers are blocked, they would never be joined). The buffered
+    output is flushed first and the marketplace is closed (e.g. so that a
+    TracingMarketplace writes the rest of its trace), for at most
+    CLOSE_TIMEOUT seconds in case closing blocks too.
+    """
+    print(f"Watchdog: {report.describe()}", file=sys.stderr, flush=True)
+    if marketplace is not None:
+        closer = Thread(target=marketplace.close, name="WatchdogClose", daemon=True)
+        closer.start()
+        closer.join(CLOSE_TIMEOUT)
+    sys.stdout.flush()
+    exit_process(EXIT_STALLED)
+
+
+class Watchdog(Thread):
+    """
+    Daemon thread that samples Marketplace.progress. When there are open carts
+    and none of them made progress for window seconds, it calls on_stall with
+    the marketplace's StallReport and stops. By default, on_stall aborts the
+    process after closing the marketplace.
+    """
+
+    def __init__(self, marketplace, window, on_stall=None, interval=None):
+
+        """
+        Constructor
+
+        :type marketplace: Marketplace
+        :param marketplace: the watched marketplace
+
+        :type window: Float
+        :param window: seconds without progress after which the run is stalled
+
+        :type on_stall: Function
+        :param on_stall: called with the StallReport (abort by default)
+
+        :type interval: Float
+        :param interval: seconds between two samples (window / 10 by default)
+        """
+
+        Thread.__init__(self, name="Watchdog", daemon=True)
+        self.marketplace = marketplace
+        self.window = window
+        self.on_stall = on_stall if on_stall is not None else \
+            partial(abort, marketplace=marketplace)
+        self.interval = interval if interval is not None else window / 10
+        self.stopped = Event()
+
+    def run(self):
+        progress = self.marketplace.progress
+        last_progress = time.monotonic()
+        while not self.stopped.wait(self.interval):
+            if self.marketplace.closed:
+                return
+            now = time.monotonic()
+            if self.marketplace.progress != progress or \
+                    not self.marketplace.get_inventory().open_carts:
+                progress = self.marketplace.progress
+                last_progress = now
+            elif now - last_progress >= self.window:
+                self.on_stall(self.marketplace.diagnose())
+                return
+
+    def stop(self):
+        """
+        Stops watching.
+        """
+        self.stopped.set()
+        self.join()
@@ -11,3 +11,6 @@ python3 test_generator.py 08 10 50 5 40 1 5
 python3 test_generator.py 09 20 5 2 25 1 2
 python3 test_generator.py 10 50 200 10 40 1 5
 
+
+# load tests: usage: load_generator.py [-h] [--seed SEED] [--batch_size BATCH_SIZE] [--no-removal] test_name [producers] [consumers] [products] [marketplace_q] [min_carts] [max_carts] [max_operations]
+# python3 load_generator.py load 1000 1000000 200 40 1 3
@@ -0,0 +1,316 @@
+"""
+Generates high-volume (load test) input and reference output files.
+
+Unlike test_generator.py, nothing is kept in memory besides the product pool
+and the batch that is currently being written: the random values are drawn in
+batches (with NumPy when it is installed), the input file is streamed to disk
+and the expected multiset of bought products is written consumer by consumer,
+as a .ref.out.counts file (see check_test.py).
+
+Script input
+    - test file name
+    - number of producers
+    - number of consumers
+    - number of products (may exceed the number of known coffee/tea names)
+    - marketplace queue
+    - min number of carts per consumer
+    - max number of carts per consumer
+    - max number of operations per cart
+    - seed
+    - batch size
+    - should have removal operations
+"""
+import argparse
+import random
+from collections import Counter
+from json import dumps
+
+from tema.product import *  # pylint: disable=wildcard-import, unused-wildcard-import
+from test_utils import *  # pylint: disable=wildcard-import, unused-wildcard-import
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class BatchSampler:
+    """
+    Draws whole batches of random numbers with a single call. Uses a seeded NumPy
+    generator when available and falls back to the standard library otherwise
+    (the two backends produce different, but individually reproducible, tests).
+    """
+
+    def __init__(self, seed):
+        if numpy is not None:
+            self.rng = numpy.random.default_rng(seed)
+        else:
+            self.rng = random.Random(seed)
+
+    def integers(self, low, high, size):
+        """
+        :return: a list of size ints drawn uniformly from [low, high]
+        """
+        if numpy is not None:
+            return self.rng.integers(low, high + 1, size=size).tolist()
+        return [self.rng.randint(low, high) for _ in range(size)]
+
+    def uniform(self, low, high, size):
+        """
+        :return: a list of size floats drawn uniformly from [low, high), rounded to 2 decimals
+        """
+        if numpy is not None:
+            return numpy.round(self.rng.uniform(low, high, size=size), 2).tolist()
+        return [round(self.rng.uniform(low, high), 2) for _ in range(size)]
+
+
+def parse_input():
+    """
+    Parses command line input and returns a dictionary with all parameters.
+    :return: a dict with all the arguments of the script
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(ARG_TEST_NAME, type=str, help="Test file name (no extension)")
+    parser.add_argument(ARG_PRODUCERS, type=int, nargs='?',
+                        default=DEFAULT_NUM_PRODUCERS, help="number of producers")
+    parser.add_argument(ARG_CONSUMERS, type=int, nargs='?',
+                        default=DEFAULT_NUM_CONSUMERS, help="number of consumers")
+    parser.add_argument(ARG_PRODUCTS, type=int, nargs='?',
+                        default=DEFAULT_NUM_PRODUCTS, help="number of products")
+    parser.add_argument(ARG_MARKETPLACE_Q, type=int, nargs='?',
+                        default=DEFAULT_MARKETPLACE_QUEUE_SIZE,
+                        help="queue size in the marketplace for each producer")
+    parser.add_argument(ARG_MIN_CARTS, type=int, nargs='?',
+                        default=DEFAULT_MIN_NUMBER_CARTS_PER_CONSUMER,
+                        help="minimum number of carts per consumer")
+    parser.add_argument(ARG_MAX_CARTS, type=int, nargs='?',
+                        default=DEFAULT_MAX_NUMBER_CARTS_PER_CONSUMER,
+                        help="maximum number of carts per consumer")
+    parser.add_argument(ARG_MAX_OPERATIONS, type=int, nargs='?',
+                        default=DEFAULT_LOAD_MAX_OPERATIONS_PER_CART,
+                        help="maximum number of add operations per cart")
+    parser.add_argument("--" + ARG_SEED, type=int, default=DEFAULT_SEED,
+                        help="seed of the random number generator")
+    parser.add_argument("--" + ARG_BATCH_SIZE, type=int, default=DEFAULT_BATCH_SIZE,
+                        help="number of producers/consumers generated per batch")
+    parser.add_argument("--no-removal", dest=ARG_SUPPORTS_REMOVAL, action="store_false",
+                        help="do not generate removal operations")
+
+    return parser.parse_args().__dict__
+
+
+def sanitize_inputs(arguments):
+    """
+    Checks that all the numeric arguments are positive and the cart bounds are ordered.
+    :param arguments: the command line arguments
+    :return: True if all checked arguments are ok, False if at least one argument is not ok
+    """
+    return all(arguments[arg] > 0 for arg in (ARG_PRODUCERS, ARG_CONSUMERS, ARG_PRODUCTS,
+                                               ARG_MARKETPLACE_Q, ARG_MIN_CARTS, ARG_MAX_CARTS,
+                                               ARG_MAX_OPERATIONS, ARG_BATCH_SIZE)) \
+        and arguments[ARG_MAX_CARTS] >= arguments[ARG_MIN_CARTS]
+
+
+def product_name(names, index):
+    """
+    Picks a name for the index-th product of a kind. Once the known names are
+    used up, they are reused with a numeric suffix, so the pool is unbounded.
+    """
+    name = names[index % len(names)]
+    if index >= len(names):
+        name = f"{name} {index // len(names) + 1}"
+    return name
+
+
+def generate_products(count, sampler):
+    """
+    Generates count products, 50% coffee and 50% tea, like test_generator.py.
+    :return: a list of (product_id, product dict) pairs
+    """
+    num_coffees = (count + 1) // 2
+    prices = sampler.integers(1, 10, count)
+    acidities = sampler.uniform(MIN_ACIDITY, MAX_ACIDITY, num_coffees)
+    roast_levels = sampler.integers(0, len(ROAST_LEVEL) - 1, num_coffees)
+    tea_names = list(TEA_NAMES_TYPES.keys())
+
+    products = []
+    for i in range(count):
+        if i < num_coffees:
+            product = {"product_type": "Coffee",
+                       "name": product_name(COFFEE_NAMES, i),
+                       "acidity": acidities[i],
+                       "roast_level": ROAST_LEVEL[roast_levels[i]]}
+        else:
+            tea_index = i - num_coffees
+            product = {"product_type": "Tea",
+                       "name": product_name(tea_names, tea_index),
+                       "type": TEA_NAMES_TYPES[tea_names[tea_index % len(tea_names)]]}
+        product["price"] = prices[i]
+        products.append((PRODUCT_PREFIX + str(i + 1), product))
+
+    return products
+
+
+def generate_producers(count, demand_pool, sampler, batch_size):
+    """
+    Yields the producers batch by batch. Producer i produces only product
+    i % demand_pool: every product that a consumer may ask for has a producer
+    and a queue can only fill up with a product nobody needs anymore, so the
+    deadlock described in test_generator.generate_producers cannot happen.
+    """
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        quantities = sampler.integers(1, DEFAULT_LOAD_MAX_PRODUCED_QUANTITY, size)
+        sleep_times = sampler.uniform(MIN_WAIT_TIME, MAX_WAIT_TIME, size)
+        republish_times = sampler.uniform(MIN_WAIT_TIME, MAX_WAIT_TIME, size)
+
+        for i in range(size):
+            yield {"name": PRODUCER_NAME_PREFIX + str(start + i + 1),
+                   ARG_PRODUCTS: [[PRODUCT_PREFIX + str((start + i) % demand_pool + 1),
+                                   quantities[i], sleep_times[i]]],
+                   "republish_wait_time": republish_times[i]}
+
+
+def lexicographic_range(count):
+    """
+    Yields 1..count in the order of their string representation (1, 10, 11, ..., 2, ...).
+    Consumers are generated in this order so that their reference lines are
+    already sorted and can be written without sorting the whole reference.
+    """
+    current = 1
+    for _ in range(count):
+        yield current
+        if current * 10 <= count:
+            current *= 10
+            continue
+        while current % 10 == 9 or current + 1 > count:
+            current //= 10
+        current += 1
+
+
+def generate_consumers(arguments, demand_pool, sampler):
+    """
+    Yields (consumer, expected_cart) pairs batch by batch, where expected_cart
+    is a Counter of product indexes summed over all the consumer's carts.
+    """
+    count = arguments[ARG_CONSUMERS]
+    batch_size = arguments[ARG_BATCH_SIZE]
+    max_operations = min(demand_pool, arguments[ARG_MAX_OPERATIONS])
+    names = lexicographic_range(count)
+
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        retry_times = sampler.uniform(MIN_WAIT_TIME, MAX_WAIT_TIME, size)
+        num_carts = sampler.integers(arguments[ARG_MIN_CARTS], arguments[ARG_MAX_CARTS], size)
+        total_carts = sum(num_carts)
+        num_operations = sampler.integers(1, max_operations, total_carts)
+        removals = sampler.integers(0, 1 if arguments[ARG_SUPPORTS_REMOVAL] else 0, total_carts)
+        removal_picks = sampler.uniform(0, 1, total_carts)
+        removal_quantities = sampler.uniform(0, 1, total_carts)
+        total_operations = sum(num_operations)
+        product_indexes = sampler.integers(0, demand_pool - 1, total_operations)
+        quantities = sampler.integers(1, DEFAULT_LOAD_MAX_QUANTITY, total_operations)
+
+        cart_index = 0
+        offset = 0
+        for i in range(size):
+            carts = []
+            expected_cart = Counter()
+            for _ in range(num_carts[i]):
+                end = offset + num_operations[cart_index]
+                # duplicates are dropped, so a cart may have less than num_operations products
+                cart = dict(zip(product_indexes[offset:end], quantities[offset:end]))
+                operations = [{"type": ADD_TO_CART_OP, "product": PRODUCT_PREFIX + str(index + 1),
+                               "quantity": quantity} for index, quantity in cart.items()]
+                expected_cart.update(cart)
+
+                if removals[cart_index]:
+                    index = list(cart)[min(int(removal_picks[cart_index] * len(cart)),
+                                           len(cart) - 1)]
+                    quantity = min(1 + int(removal_quantities[cart_index] * cart[index]),
+                                   cart[index])
+                    operations.append({"type": REMOVE_FROM_CART_OP,
+                                       "product": PRODUCT_PREFIX + str(index + 1),
+                                       "quantity": quantity})
+                    expected_cart[index] -= quantity
+
+                carts.append(operations)
+                offset = end
+                cart_index += 1
+
+            yield ({"name": CONSUMER_NAME_PREFIX + str(next(names)),
+                    "retry_wait_time": retry_times[i],
+                    "carts": carts}, +expected_cart)
+
+
+def write_json_list(output_file, key, items):
+    """
+    Streams a json list, one compact element per line.
+    """
+    output_file.write(f'"{key}": [')
+    separator = "\n"
+    for item in items:
+        output_file.write(separator + dumps(item))
+        separator = ",\n"
+    output_file.write("\n]")
+
+
+def generate_test():
+    """
+    Generates the load test and streams the input and reference output files
+
+    :return: nothing
+    """
+    arguments = parse_input()
+    if not sanitize_inputs(arguments):
+        print("Invalid arguments")
+        return
+    print(arguments)
+
+    sampler = BatchSampler(arguments[ARG_SEED])
+    products = generate_products(arguments[ARG_PRODUCTS], sampler)
+    # consumers ask only for products that are guaranteed to have a producer
+    demand_pool = min(arguments[ARG_PRODUCTS], arguments[ARG_PRODUCERS])
+    product_lines = [str(globals()[product["product_type"]](
+        **{k: v for k, v in product.items() if k != "product_type"}))
+                     for _, product in products[:demand_pool]]
+
+    test_name = arguments[ARG_TEST_NAME]
+    with open(f'{TESTS_DIR}/{test_name}.in', 'w') as input_file, \
+            open(f'{TESTS_DIR}/{test_name}.ref.out.counts', 'w') as output_file:
+        input_file.write('{\n"products": {')
+        input_file.write(",".join(f'\n{dumps(prod_id)}: {dumps(product)}'
+                                  for prod_id, product in products))
+        input_file.write("\n},\n")
+
+        write_json_list(input_file, ARG_PRODUCERS,
+                        generate_producers(arguments[ARG_PRODUCERS], demand_pool, sampler,
+                                           arguments[ARG_BATCH_SIZE]))
+        input_file.write(",\n")
+
+        def consumers():
+            # the reference lines are written while the consumers are streamed
+            for consumer, expected_cart in generate_consumers(arguments, demand_pool, sampler):
+                for line, count in sorted((f'{consumer["name"]} bought {product_lines[index]}',
+                                           count) for index, count in expected_cart.items()):
+                    output_file.write(f"{count}\t{line}\n")
+                yield consumer
+
+        write_json_list(input_file, ARG_CONSUMERS, consumers())
+        input_file.write(",\n")
+        input_file.write(f'"marketplace": '
+                         f'{dumps(generate_marketplace(arguments[ARG_MARKETPLACE_Q]))}\n}}\n')
+
+
+def generate_marketplace(queue_size):
+    """
+    Generates the marketplace
+    :type queue_size: int
+    :param queue_size: the queue size for each producer
+    :return: a dict representing the markeplace
+    """
+    return {"queue_size_per_producer": queue_size}
+
+
+if __name__ == "__main__":
+    generate_test()
@@ -52,3 +52,15 @@ ARG_MAX_CARTS = "max_carts"
 ARG_MARKETPLACE_Q = "marketplace_q"
 ARG_IS_BASIC = "is_basic"
 ARG_SUPPORTS_REMOVAL = "supports_removal"
+
+# Load test generator (load_generator.py) related constants
+DEFAULT_SEED = 0
+DEFAULT_BATCH_SIZE = 65536
+DEFAULT_LOAD_MAX_OPERATIONS_PER_CART = 5
+DEFAULT_LOAD_MAX_QUANTITY = 5
+DEFAULT_LOAD_MAX_PRODUCED_QUANTITY = 3
+MIN_WAIT_TIME = 0.05
+MAX_WAIT_TIME = 0.4
+ARG_SEED = "seed"
+ARG_BATCH_SIZE = "batch_size"
+ARG_MAX_OPERATIONS = "max_operations"
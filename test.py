@@ -6,13 +6,21 @@ Assignment 1
 March 2020
 """
 
+import argparse
 import sys
 from json import loads
 
 from tema.producer import Producer
 from tema.consumer import Consumer
+from tema.admission import AdmissionControl
+from tema.analyzer import DEADLOCKS, analyze
 from tema.marketplace import Marketplace
+from tema.observability import Observability
+from tema.plan import PlanCompiler
 from tema.product import Product, Coffee, Tea
+from tema.profiler import SamplingProfiler
+from tema.trace import TracingMarketplace
+from tema.watchdog import Watchdog
 
 
 def main():
@@ -20,15 +28,34 @@ def main():
         Convert the market_configuration input file into specific models:
         Producer, Consumer, Marketplace
     """
-    try:
-        filename = sys.argv[1]
-    except IndexError:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename", nargs="?")
+    parser.add_argument("--trace", metavar="TRACE_FILE",
+                        help="record every marketplace call (replay with python3 -m tema.trace)")
+    parser.add_argument("--log", metavar="LOG_FILE", default="marketplace.log",
+                        help="the marketplace's rotating log file")
+    parser.add_argument("--admission", action="store_true",
+                        help="shed the consumers' retries when the marketplace is saturated")
+    parser.add_argument("--watchdog", metavar="SECONDS", type=float, default=10,
+                        help="abort when no cart makes progress for this long (0 to disable)")
+    parser.add_argument("--profile", metavar="STACKS_FILE",
+                        help="sample the producers and consumers, write their collapsed stacks "
+                             "(flame graph input) and print the time per marketplace method")
+    arguments = parser.parse_args()
+    filename = arguments.filename
+    if filename is None:
         print("no input file specified")
         raise SystemExit
 
     with open(filename) as input_file:
         market_config = loads(input_file.read())
 
+    # fail right away if some cart can never be completed
+    analysis = analyze(market_config)
+    if analysis.verdict == DEADLOCKS:
+        print(f"{filename}: {analysis.describe()}", file=sys.stderr)
+        raise SystemExit(2)
+
     # turn product definitions into actual products
     products = {}
 
@@ -43,14 +70,26 @@ def main():
                                 for i, quantity, sleep_time
                                 in producer['products']]
 
-    # turn product ids into products in consumer order lists and expected carts
+    # compile the consumers' carts into plans, one compiler for all of them so the equal
+    # carts are shared; the parsed operations are dropped as soon as they are compiled
+    compiler = PlanCompiler()
     for consumer in market_config['consumers']:
-        for cart in consumer['carts']:
-            for operation in cart:
-                operation['product'] = products[operation['product']]
+        consumer['carts'] = compiler.compile(consumer['carts'], products)
 
     # build the marketplace
-    marketplace = Marketplace(**market_config['marketplace'])
+    observability = Observability(log_file=arguments.log, output=print)
+    marketplace = Marketplace(**market_config['marketplace'], observability=observability)
+    if arguments.admission:
+        marketplace = AdmissionControl(marketplace)
+    if arguments.trace:
+        marketplace = TracingMarketplace(marketplace, arguments.trace)
+
+    profiler = None
+    if arguments.profile:
+        profiler = SamplingProfiler(attribute_to=Marketplace,
+                                    selected=lambda thread: isinstance(thread,
+                                                                       (Producer, Consumer)))
+        profiler.start()
 
     # build and start the producers
     producers = [Producer(**p_market_config, marketplace=marketplace, daemon=True)
@@ -62,13 +101,29 @@ def main():
     # build and start the consumers
     consumers = [Consumer(**c_market_config, marketplace=marketplace)
                  for c_market_config in market_config['consumers']]
+    del market_config
 
     for consumer in consumers:
         consumer.start()
 
+    if arguments.watchdog > 0:
+        Watchdog(marketplace, arguments.watchdog).start()
+
     for consumer in consumers:
         consumer.join()
 
+    # stop the producers (and the trace, if any)
+    marketplace.close()
+    for producer in producers:
+        producer.join()
+
+    if profiler is not None:
+        profiler.stop()
+        with open(arguments.profile, "w") as stacks_file:
+            profiler.write_collapsed(stacks_file)
+        # stdout holds the orders
+        profiler.write_summary(sys.stderr)
+
 
 if __name__ == '__main__':
     main()